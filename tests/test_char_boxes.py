@@ -0,0 +1,36 @@
+import sys
+from os.path import abspath, dirname
+from pathlib import Path
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import pytest
+
+from webvicob.html_transform import modify_html
+from webvicob.wikipedia.wikipedia import get_boxes, get_driver, load_html
+
+CHROME_PATH = Path("resources/chromedriver")
+
+TRANSFORMED_HTML = """<html><head></head><body>
+<p style="text-transform: uppercase">Straße ﬁne</p>
+<p style="text-transform: capitalize">hello <i>wor</i>ld <b>next</b>   word</p>
+<p style="text-transform: lowercase">  MIXED
+    Case  </p>
+</body></html>"""
+
+
+@pytest.mark.skipif(not CHROME_PATH.exists(), reason="chromedriver is not installed")
+def test_char_box_parity(tmp_path):
+    driver = get_driver(chrome_path=str(CHROME_PATH), capture_width=800)
+    try:
+        chars = {}
+        for char_boxes in ("span", "range"):
+            html = modify_html(TRANSFORMED_HTML, char_spans=char_boxes == "span")
+            load_html(driver, html, tmp_path / f"{char_boxes}.html")
+            chars[char_boxes] = [box for box in get_boxes(driver, char_boxes) if box["box_type"] == "char"]
+    finally:
+        driver.quit()
+
+    assert [box["text"] for box in chars["range"]] == [box["text"] for box in chars["span"]]
+    for range_box, span_box in zip(chars["range"], chars["span"]):
+        assert range_box["bbox"] == pytest.approx(span_box["bbox"], abs=2)
@@ -0,0 +1,27 @@
+import sys
+from os.path import abspath, dirname
+
+from bs4 import BeautifulSoup
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.chunker import WikiHtmlChunker
+
+
+def test_height_aware_chunker():
+    paragraphs = "".join(f"<p>{'word ' * 200}</p>" for _ in range(20))
+    html = (
+        "<html><head><title>Title</title></head><body>"
+        f'<section data-mw-section-id="0" id="mwAQ">{paragraphs}</section>'
+        f'<section data-mw-section-id="1" id="mwBQ"><h2>Section</h2>{paragraphs}</section>'
+        "</body></html>"
+    )
+    assert len(WikiHtmlChunker()(html)) == 2
+
+    chunker = WikiHtmlChunker(max_render_height=1000, capture_width=800)
+    chunks = chunker(html)
+    assert len(chunks) > 2
+    assert "".join(chunks).count("<p>") == 40
+    for chunk in chunks:
+        body = BeautifulSoup(chunk, "html.parser").body
+        assert chunker.estimate_render_height(body) <= 1000
@@ -0,0 +1,28 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.compression import ZSTD_MAGIC
+from webvicob.lmdb_maker import WebvicobLMDB, encode
+
+
+def test_html_compression(tmp_path):
+    htmls = [f'<p><span class="ocr-char">{i}</span>{"텍스트 " * (i + 10)}</p>' for i in range(40)]
+
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False, html_compression="zstd")
+    writer.html_compressor.num_train_samples = 16
+    for i, html in enumerate(htmls):
+        writer.put_raw_html(html, i)
+        writer.put_html(html, i)
+        if i == 7:
+            # values held back for training are already stored, e.g. for an interrupted build
+            assert writer.get(encode("7_html")) == encode(html)
+    writer.put_num_data(len(htmls))
+    writer.wrap_up()
+    assert "(0 values)" not in writer.html_compressor.report()
+
+    reader = WebvicobLMDB(tmp_path / "train", verbose=False)
+    assert reader.get(encode("0_html")).startswith(ZSTD_MAGIC)
+    assert [reader.get_html(i) for i in range(len(htmls))] == htmls
+    assert [reader.get_raw_html(i) for i in range(len(htmls))] == htmls
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.html_transform import get_html_transform, modify_html
+from webvicob.lmdb_maker import WebvicobLMDB, encode
+from webvicob.wikipedia.verify_html import verify_derived_html
+
+
+def test_derived_html(tmp_path):
+    opt = {"bake_styles": True, "remove_background": True, "unroll_contents": False}
+    raw_htmls = [f"<html><head></head><body><p>sample {i}</p><label>x</label></body></html>" for i in range(5)]
+    for html_storage in ("full", "derived"):
+        writer = WebvicobLMDB(tmp_path / html_storage, verbose=False, html_storage=html_storage)
+        for i, raw_html in enumerate(raw_htmls):
+            writer.put_raw_html(raw_html, i)
+            writer.put_html(modify_html(raw_html, **opt), i, get_html_transform(opt))
+        writer.put_num_data(len(raw_htmls))
+        writer.wrap_up()
+        assert verify_derived_html(tmp_path / html_storage)
+
+    full = WebvicobLMDB(tmp_path / "full", readonly=True, verbose=False)
+    derived = WebvicobLMDB(tmp_path / "derived", readonly=True, verbose=False)
+    assert derived.get(encode("0_html")) is None
+    assert [derived.get_html(i) for i in range(5)] == [full.get_html(i) for i in range(5)]
+
+
+def test_shared_html(tmp_path):
+    opt = {"bake_styles": True, "remove_background": True, "unroll_contents": False}
+    raw_html = "<html><head></head><body><p>one page, two widths</p></body></html>"
+    writer = WebvicobLMDB(tmp_path / "src", verbose=False, html_storage="derived")
+    writer.put_raw_html(raw_html, 0)
+    writer.put_html(modify_html(raw_html, **opt), 0, get_html_transform(opt))
+    writer.put_html_ref(0, 1)
+    assert writer.get(encode("1_raw_html")) is None
+    assert writer.get_raw_html(1) == raw_html
+    assert writer.get_html(1) == writer.get_html(0) == modify_html(raw_html, **opt)
+
+    # copied alone, the html is stored with the copy.
+    copy = WebvicobLMDB(tmp_path / "copy", verbose=False)
+    copy.copy_sample(writer, 1, 0)
+    assert copy.get(encode("0_html_ref")) is None
+    assert copy.get_raw_html(0) == raw_html
+    assert copy.get_html(0) == writer.get_html(1)
+
+    # copied with the sample holding its html, the reference is kept.
+    copy.copy_sample(writer, 0, 1)
+    copy.copy_sample(writer, 1, 2, html_idx=1)
+    assert copy.get(encode("2_raw_html")) is None
+    assert copy.get_html_idx(2) == 1 and copy.get_html(2) == writer.get_html(1)
+
+
+def test_char_ranges_html(tmp_path):
+    opt = {"bake_styles": False, "remove_background": True, "unroll_contents": False, "char_boxes": "range"}
+    raw_html = "<html><head></head><body><p>no spans</p></body></html>"
+    html = modify_html(raw_html, opt["bake_styles"], opt["remove_background"], opt["unroll_contents"], False)
+    assert "ocr-char" not in html and "no spans" in html
+
+    writer = WebvicobLMDB(tmp_path / "range", verbose=False, html_storage="derived")
+    writer.put_raw_html(raw_html, 0)
+    writer.put_html(html, 0, get_html_transform(opt))
+    assert writer.get_html(0) == html
+
+
+def test_lmdb_maker_imports_no_pipeline():
+    code = "import sys, webvicob.lmdb_maker; assert 'webvicob.wikipedia.wikipedia' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=dirname(dirname(abspath(__file__))))
@@ -0,0 +1,29 @@
+import sys
+import tarfile
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from webvicob.export import INDEX_FILE, export
+from webvicob.lmdb_maker import WebvicobLMDB
+
+
+def test_webdataset_export(tmp_path):
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False)
+    _, jpeg = cv2.imencode(".jpg", np.zeros((16, 16, 3), dtype=np.uint8))
+    _, png = cv2.imencode(".png", np.zeros((16, 16, 3), dtype=np.uint8))
+    for i in range(10):
+        writer.put_img(png if i == 9 else jpeg, i)
+        writer.put_annots({"lines": [], "paragraphs": [], "tables": [], "images": []}, i)
+    writer.put_num_data(10)
+    writer.wrap_up()
+
+    export(tmp_path / "train", tmp_path / "shards", shard_size=4, num_process=1, shuffle=False)
+    shards = sorted((tmp_path / "shards").glob("*.tar"))
+    assert [path.name for path in shards] == ["train-000000.tar", "train-000001.tar", "train-000002.tar"]
+    with tarfile.open(shards[-1]) as tar:
+        assert tar.getnames() == ["000000008.jpg", "000000008.json", "000000009.png", "000000009.json"]
+    assert (tmp_path / "shards" / INDEX_FILE).exists()
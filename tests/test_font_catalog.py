@@ -0,0 +1,41 @@
+import shutil
+import sys
+from os.path import abspath, dirname
+from pathlib import Path
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import matplotlib
+
+from webvicob.font_catalog import load_font_paths
+from webvicob.wikipedia.wikipedia import get_font_paths, get_glyph_ratio
+
+
+def test_font_catalog(tmp_path):
+    font_dir = tmp_path / "fonts"
+    font_dir.mkdir()
+    shutil.copy(Path(matplotlib.get_data_path()) / "fonts/ttf/DejaVuSans.ttf", font_dir)
+    (font_dir / "broken.ttf").write_bytes(b"not a font")
+
+    font_paths = load_font_paths(font_dir)
+    assert font_paths == [str(font_dir.resolve() / "DejaVuSans.ttf")]
+    assert (tmp_path / "fonts_catalog.json").exists()
+    assert load_font_paths(font_dir, scripts=["han"]) == []
+    assert get_font_paths(font_dir, False, target_lang="ru") == font_paths  # DejaVuSans has cyrillic
+    assert get_font_paths(font_dir, False, target_lang="ja") == font_paths  # no japanese font, every font
+
+    assert get_glyph_ratio(font_paths[0], "g") == get_glyph_ratio(font_paths[0], "g") != (None, None)
+
+
+def test_font_catalog_rebuild(tmp_path):
+    font_dir = tmp_path / "fonts"
+    font_dir.mkdir()
+    ttf_dir = Path(matplotlib.get_data_path()) / "fonts/ttf"
+    shutil.copy(ttf_dir / "DejaVuSans.ttf", font_dir)
+    assert len(load_font_paths(font_dir)) == 1
+
+    shutil.copy(ttf_dir / "DejaVuSerif.ttf", font_dir)  # a font added after the catalog was built
+    assert len(load_font_paths(font_dir)) == 2
+    (font_dir / "DejaVuSans.ttf").unlink()
+    assert load_font_paths(font_dir) == [str(font_dir.resolve() / "DejaVuSerif.ttf")]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["fonts", "fonts_catalog.json"]  # no temp file left
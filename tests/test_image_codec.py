@@ -0,0 +1,41 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from webvicob.image_codec import (
+    benchmark_codecs,
+    detect_codec,
+    encode_img,
+    get_image_codec,
+)
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.metadata import get_image_size
+
+
+def test_image_codecs():
+    img = np.full((300, 200, 3), 255, dtype=np.uint8)
+    cv2.putText(img, "webvicob", (10, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    for codec, quality, subsampling in [("jpeg", 90, "444"), ("webp", 90, None), ("webp", 101, None), ("png", 0, None)]:
+        buffer = encode_img(img, get_image_codec(codec, quality, subsampling))
+        assert detect_codec(buffer) == codec
+        assert get_image_size(buffer) == (200, 300)
+        decoded = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if codec == "png" or quality > 100:
+            assert np.array_equal(decoded, img)
+
+
+def test_benchmark_lossless_only(tmp_path, capsys):
+    img = np.full((64, 48, 3), 255, dtype=np.uint8)
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False)
+    for idx, codec in enumerate(["jpeg", "png", "webp"]):
+        quality = 101 if codec == "webp" else 95
+        writer.put_img(encode_img(img, get_image_codec(codec, quality)).tobytes(), idx)
+    writer.put_num_data(3)
+    writer.wrap_up()
+
+    benchmark_codecs(tmp_path / "train")
+    assert "2 samples" in capsys.readouterr().out  # the jpeg is skipped
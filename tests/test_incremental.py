@@ -0,0 +1,71 @@
+import json
+import sys
+from os.path import abspath, dirname
+from pathlib import Path
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.wikipedia.chunker import WikiHtmlChunker
+from webvicob.wikipedia.incremental import (
+    FINGERPRINT_FILE,
+    FingerprintIndex,
+    IncrementalBuild,
+    get_build_options,
+)
+from webvicob.wikipedia.wikipedia import html_generator
+
+RAW_PATH = Path(dirname(dirname(abspath(__file__)))) / "resources/workspace_example/raw/dewiki_0.ndjson"
+
+
+def make_build(build_dir, options):
+    for mode in ("train", "val", "test"):
+        WebvicobLMDB(build_dir / mode, verbose=False).wrap_up()
+
+    fingerprints = FingerprintIndex(options)
+    for article_id, num_chunks, num_done in (("a", 2, 2), ("b", 2, 1)):  # chunk 1 of "b" failed
+        for chunk_no in range(num_done):
+            result = {"article_id": article_id, "revision": 1, "chunk_no": chunk_no, "num_chunks": num_chunks}
+            fingerprints.add(result, "train", len(fingerprints.articles))
+            fingerprints.done(result)
+    fingerprints.save(build_dir)
+
+
+def test_incremental_filter(tmp_path):
+    options = get_build_options({"capture_widths": (1200,), "char_boxes": "span"})
+    make_build(tmp_path, options)
+    inputs = [
+        {"status": "unchanged", "key": "a_unchanged", "article_id": "a", "revision": 1},
+        {"key": "b_0", "article_id": "b", "revision": 1},
+    ]
+
+    incremental = IncrementalBuild(tmp_path, options)
+    assert incremental.is_unchanged("a", 1) and not incremental.is_unchanged("a", 2)
+    assert not incremental.is_unchanged("b", 1)  # partially written articles are rendered again
+    outputs = list(incremental.filter(inputs))
+    assert [out["status"] for out in outputs[:2]] == ["copied", "copied"] and outputs[2]["key"] == "b_0"
+    assert incremental.changelog["unchanged"] == ["a"] and incremental.changelog["added"] == ["b"]
+    incremental.close()
+
+    incremental = IncrementalBuild(tmp_path, get_build_options({"capture_widths": (1600,), "char_boxes": "span"}))
+    assert not incremental.is_unchanged("a", 1)
+    incremental.close()
+
+
+def test_quarantined_chunks_complete(tmp_path):
+    (tmp_path / "raw").mkdir()
+    (tmp_path / "raw" / RAW_PATH.name).symlink_to(RAW_PATH)
+    chunker = WikiHtmlChunker(max_render_height=1000)
+    inputs = html_generator(tmp_path, "de", "shm", None, None, True, chunker)
+    article_id = next(inp["article_id"] for inp in inputs if inp["num_chunks"] > 1)
+    quarantine = {f"{article_id}_1"}
+
+    fingerprints = FingerprintIndex()
+    for inp in html_generator(tmp_path, "de", "shm", None, None, True, chunker, quarantine):
+        assert inp["key"] not in quarantine
+        fingerprints.add(inp, "train", 0)
+        fingerprints.done(inp)
+        if inp["article_id"] == article_id and inp["chunk_no"] == inp["num_chunks"]:
+            break  # the last chunk of the article, one chunk before it is quarantined
+    fingerprints.save(tmp_path)
+    assert str(article_id) in json.loads((tmp_path / FINGERPRINT_FILE).read_text())["articles"]
@@ -0,0 +1,36 @@
+import pickle
+import sys
+from os.path import abspath, dirname
+
+import cv2
+import numpy as np
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.lmdb_reader import WebvicobLMDBReader
+
+
+def test_lmdb_reader(tmp_path):
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False)
+    img = np.full((64, 32, 3), 128, dtype=np.uint8)
+    for i in range(3):
+        writer.put_img(cv2.imencode(".jpg", img)[1].tobytes(), i)
+        writer.put_annots({"idx": i}, i)
+    writer.put_num_data(3)
+    writer.env.close()
+
+    reader = WebvicobLMDBReader(tmp_path / "train", reduce_factor=2)
+    assert len(reader) == 3
+    assert reader.get_img(0).shape == (32, 16, 3)
+    samples = reader.getmulti_samples([2, 0])
+    assert [sample["annots"]["idx"] for sample in samples] == [2, 0]
+
+    state = pickle.loads(pickle.dumps(reader)).__dict__
+    assert state["_env"] is None and state["_txn"] is None
+    buffer = reader.get_img_buffer(1)
+    [sample] = reader.getmulti_samples([1], decode=False)
+    reader.close()
+    # copies outlive the transaction
+    assert cv2.imdecode(buffer, cv2.IMREAD_COLOR).shape == (64, 32, 3)
+    assert np.array_equal(sample["img"], buffer)
@@ -0,0 +1,37 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from webvicob.metadata import (
+    SampleMetadata,
+    SampleMetadataWriter,
+    get_image_size,
+    make_sample_meta,
+)
+
+
+def test_metadata_select(tmp_path):
+    writer = SampleMetadataWriter(tmp_path, chunk_size=3)
+    for idx, height in enumerate([300, 500, 700, 900]):
+        _, jpeg = cv2.imencode(".jpg", np.zeros((height, 120, 3), dtype=np.uint8))
+        assert get_image_size(jpeg) == (120, height)
+
+        annots = {"lines": [], "paragraphs": [], "tables": [{"bbox": []}] * idx, "images": [], "capture_width": 1200}
+        font2path = {"p": "file:///fonts/a.ttf", "q": f"file:///fonts/{idx % 2}.ttf"}
+        writer.append(idx, make_sample_meta(annots, jpeg, "en", font2path, article_id=idx))
+        if idx == 2:
+            # the first chunk is on disk before save()
+            assert len(SampleMetadata(tmp_path)) == 3
+    writer.save()
+
+    meta = SampleMetadata(tmp_path)
+    assert len(meta) == 4
+    assert meta.select(page_height=(400, 800)).tolist() == [1, 2]
+    assert meta.select(num_tables=[0, 3], lang="en").tolist() == [0, 3]
+    assert meta.row(2)["page_height"] == 700
+    assert meta.row(1)["fonts"] == ["1.ttf", "a.ttf"]
+    assert meta.font_mask(["0.ttf"]).tolist() == [True, False, True, False]
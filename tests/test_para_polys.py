@@ -0,0 +1,24 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.wikipedia import (
+    para_polys_iou,
+    raster_para_polys,
+    shapely_para_polys,
+)
+
+
+def test_raster_para_polys():
+    cboxes = []
+    for line in range(5):
+        for i in range(40):
+            x = 10 + i * 10 + (30 if i > 20 else 0)
+            cboxes.append({"bbox": [x, 20 + line * 22, x + 8, 36 + line * 22]})
+    cboxes.append({"bbox": [10, 400, 18, 416]})  # far away, separate paragraph polygon
+
+    shapely_polys = shapely_para_polys(cboxes)
+    raster_polys = raster_para_polys(cboxes)
+    assert len(raster_polys) == len(shapely_polys) == 2
+    assert para_polys_iou(shapely_polys, raster_polys) > 0.9
@@ -0,0 +1,23 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.profiles import (
+    PROFILE_PREFIX,
+    cleanup_orphan_profiles,
+    get_browser_profile,
+)
+
+
+def test_orphan_profiles(tmp_path):
+    profile = get_browser_profile(tmp_path)
+    assert get_browser_profile(tmp_path) is profile
+    (profile.disk_cache_dir / "entry").write_bytes(b"0" * 100)
+    assert profile.disk_usage() == 100
+
+    orphan = tmp_path / f"{PROFILE_PREFIX}999999999_0a1b2c3d"  # pid that can not exist
+    (orphan / "cache").mkdir(parents=True)
+    (orphan / "cache" / "entry").write_bytes(b"0" * 10)
+    assert cleanup_orphan_profiles(tmp_path) == (1, 10)
+    assert not orphan.exists() and profile.path.exists()
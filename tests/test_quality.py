@@ -0,0 +1,27 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.quality import check_quality, get_box_stats, get_quality_gates
+
+
+def test_quality_gates():
+    chars = [{"box_type": "char", "text": c, "bbox": [i * 10, 0, i * 10 + 10, 20]} for i, c in enumerate("ab c")]
+    image = {"box_type": "image", "text": "", "bbox": [0, 20, 100, 100]}
+    boxes = chars + [image]
+
+    stats = get_box_stats(boxes, 100, 100)
+    assert stats["num_chars"] == 3
+    assert stats["text_coverage"] == 3 * 200 / (100 * 100)
+    assert stats["image_ratio"] == 0.8
+    # the page is the capture, not the extent of the boxes
+    assert get_box_stats(chars, 100, 100)["text_coverage"] == get_box_stats(boxes, 100, 100)["text_coverage"]
+    assert get_box_stats(boxes, 100, 200)["image_ratio"] == 0.4
+
+    assert check_quality(boxes, get_quality_gates(), 100, 100) is None
+    assert check_quality(boxes, get_quality_gates({"min_chars": 4}), 100, 100) == "min_chars"
+    assert check_quality(boxes, get_quality_gates({"min_text_coverage": 0.1}), 100, 100) == "min_text_coverage"
+    assert check_quality(boxes, get_quality_gates({"max_image_ratio": 0.5}), 100, 100) == "max_image_ratio"
+    assert check_quality(chars, get_quality_gates({"min_chars": 3, "max_image_ratio": 0.5}), 100, 100) is None
+    assert check_quality([], get_quality_gates({"min_chars": 1}), 100, 100) == "min_chars"
@@ -0,0 +1,81 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.metadata import (
+    METADATA_DIR,
+    SampleMetadata,
+    SampleMetadataWriter,
+    make_sample_meta,
+)
+from webvicob.wikipedia.reannotate import reannotate
+from webvicob.wikipedia.wikipedia import annotate, get_box_record
+
+
+def test_reannotate(tmp_path):
+    _, jpeg = cv2.imencode(".jpg", np.full((100, 200, 3), 255, dtype=np.uint8))
+    boxes = [
+        {"box_type": "char", "text": c, "alt": "", "bbox": [10 * i, 20, 10 * i + 8, 34], "font_family": "x", "group": g}
+        for i, (c, g) in enumerate([("a", "paragraph_0"), ("b", "paragraph_0"), ("c", "")])
+    ]
+    opt = {"shrink_heuristic": False, "final_width": None, "para_poly_engine": "shapely"}
+
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False)
+    writer.put_box_record(get_box_record(boxes, {}, 200, "en"), 0)
+    [(_, _, annots)] = annotate(jpeg, boxes, {}, 200, "en", opt)
+    writer.put_img(jpeg, 0)
+    writer.put_annots(annots, 0)
+    writer.put_num_data(1)
+    writer.wrap_up()
+
+    reannotate(tmp_path / "train", shrink_heuristic=False, final_width=[100, 50], num_process=1)
+    reader = WebvicobLMDB(tmp_path / "train", readonly=True, verbose=False)
+    assert reader.get_img(0).shape[1] == 100
+    assert reader.get_annots(0)["lines"][0]["words"][0]["bbox"] == [
+        x / 2 for x in annots["lines"][0]["words"][0]["bbox"]
+    ]
+    assert reader.get_box_record(0)[1] == jpeg.tobytes()
+    assert reader.get_img(0, width=50).shape[1] == 50
+    assert reader.get_annots(0, width=50)["lines"][0]["bbox"] == [x / 4 for x in annots["lines"][0]["bbox"]]
+    assert reader.get_variant_widths(0) == [50]
+    reader.env.close()
+
+    reannotate(tmp_path / "train", shrink_heuristic=False, num_process=1)
+    reader = WebvicobLMDB(tmp_path / "train", readonly=True, verbose=False)
+    assert reader.get_img(0).shape[1] == 200
+    assert reader.get_annots(0) == annots
+    assert reader.get_variant_widths(0) == []  # no stale variants of the previous final_width
+
+
+def test_reannotate_metadata(tmp_path):
+    _, jpeg = cv2.imencode(".jpg", np.full((100, 200, 3), 255, dtype=np.uint8))
+    boxes = [
+        {"box_type": "char", "text": c, "alt": "", "bbox": [10 * i, 20, 10 * i + 8, 34], "font_family": "x", "group": ""}
+        for i, c in enumerate("ab")
+    ]
+    opt = {"shrink_heuristic": False, "final_width": None, "para_poly_engine": "shapely"}
+
+    writer = WebvicobLMDB(tmp_path / "train", verbose=False)
+    metadata_writer = SampleMetadataWriter(tmp_path / "train")
+    [(_, _, annots)] = annotate(jpeg, boxes, {}, 200, "en", opt)
+    for idx in range(3):
+        if idx != 1:  # a sample without box record keeps its row
+            writer.put_box_record(get_box_record(boxes, {}, 200, "en"), idx)
+        writer.put_img(jpeg, idx)
+        writer.put_annots(annots, idx)
+        metadata_writer.append(idx, make_sample_meta(annots, jpeg.tobytes(), "en", {}, 100 + idx))
+    metadata_writer.save()
+    writer.put_num_data(3)
+    writer.wrap_up()
+
+    reannotate(tmp_path / "train", shrink_heuristic=False, final_width=[100], num_process=1)
+    metadata = SampleMetadata(tmp_path / "train")
+    assert len(metadata) == 3
+    assert metadata["article_id"].tolist() == [100, 101, 102]
+    assert metadata["page_width"].tolist() == [100, 200, 100]
+    assert not (tmp_path / "train" / f"{METADATA_DIR}.tmp").exists()
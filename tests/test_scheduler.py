@@ -0,0 +1,140 @@
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.scheduler import (
+    LookaheadBuffer,
+    PipelineStage,
+    RenderScheduler,
+    ReorderBuffer,
+    wait_for_memory,
+)
+
+
+def test_lpt_order():
+    inputs = [{"key": i, "seq": i, "html": "x" * size} for i, size in enumerate([1, 5, 3, 9, 2, 7])]
+    buffer = LookaheadBuffer(inputs, size=3)
+    order = []
+    while buffer.peek() is not None:
+        order.append(buffer.pop()["key"])
+    assert order == [1, 3, 2, 5, 4, 0]
+
+    with ThreadPool(2) as pool:
+        scheduler = RenderScheduler(pool, dict, 2, memory_watermark_mb=0, poll_interval=0.01, lookahead=4)
+        results = list(ReorderBuffer()(scheduler.imap_unordered(inputs)))
+    assert [result["seq"] for result in results] == list(range(len(inputs)))
+
+
+def test_bounded_window():
+    num_pulled = 0
+
+    def inputs():
+        nonlocal num_pulled
+        for i in range(100):
+            num_pulled += 1
+            yield {"key": i, "seq": i, "html": "x" * (i % 7)}
+        for i in range(100, 103):
+            num_pulled += 1
+            yield {"key": i, "seq": i, "status": "copied"}
+
+    with ThreadPool(2) as pool:
+        scheduler = RenderScheduler(
+            pool, dict, 2, memory_watermark_mb=0, poll_interval=0.01, lookahead=8, in_flight_per_worker=2
+        )
+        reorder = ReorderBuffer()
+        max_outstanding = 0
+        results = []
+        for result in reorder(scheduler.imap_unordered(inputs())):
+            max_outstanding = max(max_outstanding, num_pulled - len(results))
+            results.append(result)
+    assert [result["seq"] for result in results] == list(range(103))
+    # lookahead + in-flight window + results waiting in the reorder buffer (bounded by aging).
+    assert max_outstanding <= 3 * 8 + 2 * scheduler.window
+    assert scheduler.max_in_flight <= scheduler.window == 4
+    assert "parent rss" in scheduler.status()
+
+
+def test_lookahead_aging():
+    # a cheap input is handed out once `2 * size` later inputs arrived, even if later ones are more expensive.
+    inputs = [{"key": 0, "html": ""}] + [{"key": i, "html": "x" * i} for i in range(1, 20)]
+    buffer = LookaheadBuffer(inputs, size=2)
+    order = []
+    while buffer.peek() is not None:
+        order.append(buffer.pop()["key"])
+    assert sorted(order) == list(range(20))
+    assert order.index(0) <= 4
+
+
+def test_pipeline_stage():
+    def render(inp):
+        return dict(inp, status="rendered" if inp["key"] % 3 else "failed")
+
+    def annotate(result):
+        return dict(result, status="done")
+
+    inputs = [{"key": i, "seq": i, "html": "x"} for i in range(30)]
+    with ThreadPool(2) as render_pool, ThreadPool(1) as annotate_pool:
+        scheduler = RenderScheduler(render_pool, render, 2, memory_watermark_mb=0, poll_interval=0.01)
+        stage = PipelineStage(
+            annotate_pool, annotate, 2, accept=lambda result: result["status"] == "rendered", name="annotate"
+        )
+        results = list(ReorderBuffer()(stage.imap_unordered(scheduler.imap_unordered(inputs))))
+    assert [result["seq"] for result in results] == list(range(30))
+    assert [result["status"] for result in results] == ["failed" if i % 3 == 0 else "done" for i in range(30)]
+    assert stage.num_in_flight == 0
+
+
+def crash_or_sleep(inp):
+    if inp["key"] == "crash":
+        os._exit(1)  # like an OOM kill, the pool gets no result of this job
+    time.sleep(inp.get("sleep", 0))
+    return dict(inp, status="done")
+
+
+def test_dead_worker_and_deadline():
+    inputs = [{"key": "ok", "html": "x"}, {"key": "crash", "html": "x"}, {"key": "slow", "html": "x", "sleep": 60}]
+    with mp.get_context("spawn").Pool(3) as pool:
+        scheduler = RenderScheduler(pool, crash_or_sleep, 3, memory_watermark_mb=0, poll_interval=0.05, job_deadline=5)
+        start = time.monotonic()
+        results = {result["key"]: result["status"] for result in scheduler.imap_unordered(inputs)}
+    assert results == {"ok": "done", "crash": "failed", "slow": "failed"}
+    assert time.monotonic() - start < 30
+    assert scheduler.num_in_flight == 0
+
+
+def test_deadline_from_job_start():
+    # the second job waits behind the first one for longer than the deadline, but runs within it.
+    inputs = [{"key": "first", "html": "x", "sleep": 2}, {"key": "queued", "html": "x", "sleep": 2}]
+    with mp.get_context("spawn").Pool(1) as pool:
+        scheduler = RenderScheduler(pool, crash_or_sleep, 2, memory_watermark_mb=0, poll_interval=0.05, job_deadline=3)
+        results = {result["key"]: result["status"] for result in scheduler.imap_unordered(inputs)}
+    assert results == {"first": "done", "queued": "done"}
+
+
+def test_wait_for_memory(tmp_path):
+    required = 2**62  # never available
+    start = time.monotonic()
+    wait_for_memory(tmp_path, required)  # no other job running ==> starts anyway
+    assert time.monotonic() - start < 1
+
+    (tmp_path / "1").write_text(f"7 {time.time()}")  # a running job of another worker
+    threading.Timer(1.0, (tmp_path / "1").unlink).start()
+    wait_for_memory(tmp_path, required, poll_interval=0.05)
+    assert time.monotonic() - start >= 1
+
+
+def test_pipeline_stage_dead_worker():
+    rendered = [{"key": key, "seq": i, "status": "rendered"} for i, key in enumerate(["ok", "crash", "slow", "ok2"])]
+    rendered[2]["sleep"] = 60
+    with mp.get_context("spawn").Pool(2) as pool:
+        stage = PipelineStage(
+            pool, crash_or_sleep, 2, accept=lambda result: result["status"] == "rendered", job_deadline=5
+        )
+        results = {result["key"]: result["status"] for result in stage.imap_unordered(rendered)}
+    assert results == {"ok": "done", "crash": "failed", "slow": "failed", "ok2": "done"}
@@ -0,0 +1,63 @@
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import json
+
+import cv2
+import numpy as np
+
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.spatial import SPATIAL_KINDS, build_spatial_index, query_spatial_index
+
+
+def make_annots():
+    lines = []
+    for line_no in range(3):
+        y = 100 * line_no
+        chars = [{"bbox": [10 * i, y, 10 * i + 8, y + 20], "text": c} for i, c in enumerate("abc")]
+        word = {"is_latex": False, "chars": chars, "text": "abc", "bbox": [0, y, 28, y + 20]}
+        lines.append({"words": [word], "bbox": [0, y, 28, y + 20]})
+    return {
+        "paragraphs": [{"poly": [0, 0, 30, 0, 30, 230, 0, 230]}],
+        "lines": lines,
+        "images": [{"bbox": [50, 150, 90, 190]}],
+        "tables": [],
+    }
+
+
+def test_get_crop(tmp_path):
+    _, jpeg = cv2.imencode(".jpg", np.zeros((300, 100, 3), dtype=np.uint8))
+    for spatial_index in (True, False):
+        writer = WebvicobLMDB(tmp_path / str(spatial_index), verbose=False, spatial_index=spatial_index)
+        writer.put_img(jpeg, 0)
+        writer.put_annots(make_annots(), 0)
+
+        img, annots = writer.get_crop(0, 15, 90, 200, 200)
+        assert img.shape[:2] == (110, 85)
+        assert len(annots["lines"]) == 1
+        word = annots["lines"][0]["words"][0]
+        assert word["text"] == "bc" and word["bbox"] == [0, 10, 13, 30]
+        assert annots["images"] == [{"bbox": [35, 60, 75, 100]}]
+        assert len(annots["paragraphs"]) == 1
+        writer.wrap_up()
+
+
+def test_spatial_index_offsets():
+    annots = make_annots()
+    annots["lines"][1]["words"][0]["text"] = "äbç"  # offsets are in bytes
+    index, annots_json = build_spatial_index(annots)
+    assert annots_json == json.dumps(annots, ensure_ascii=False).encode("utf-8")
+    assert index["bbox"][:, 1].tolist() == sorted(index["bbox"][:, 1].tolist())
+
+    words = [json.loads(annots_json[e["start"] : e["end"]]) for e in index if SPATIAL_KINDS[e["kind"]] == "word"]
+    assert words == [line["words"][0] for line in annots["lines"]]
+    [image] = [e for e in index if SPATIAL_KINDS[e["kind"]] == "image"]
+    assert json.loads(annots_json[image["start"] : image["end"]]) == annots["images"][0]
+
+    hits = query_spatial_index(index, 0, 30, 100, 90)  # between the lines, inside the paragraph only
+    assert [SPATIAL_KINDS[e["kind"]] for e in hits] == ["paragraph"]
+    hits = query_spatial_index(index, 0, 95, 100, 110)
+    assert sorted(SPATIAL_KINDS[e["kind"]] for e in hits) == ["paragraph", "word"]
+    assert len(query_spatial_index(index, 0, 240, 100, 300)) == 0
@@ -0,0 +1,53 @@
+import sys
+from os.path import abspath, dirname
+from pathlib import Path
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+
+import webvicob.wikipedia.wikipedia as wikipedia
+from webvicob.lmdb_maker import WebvicobLMDB, encode
+from webvicob.metadata import make_sample_meta
+
+RAW_PATH = Path(dirname(dirname(abspath(__file__)))) / "resources/workspace_example/raw/dewiki_0.ndjson"
+CAPTURE_WIDTHS = (80, 60)
+FINAL_WIDTH = 40
+
+
+def fake_mp_job(inp):
+    """Every capture width of a page, with one final width variant each, without a browser."""
+    jpeg = cv2.imencode(".jpg", np.full((100, 80, 3), 255, dtype=np.uint8))[1].tobytes()
+    annots = {"paragraphs": [], "lines": [], "images": [], "tables": []}
+    samples = [
+        {
+            "jpeg": jpeg,
+            "annots": dict(annots, capture_width=width),
+            "variants": [(FINAL_WIDTH, jpeg, annots)],
+            "meta": make_sample_meta(annots, jpeg, "de", {}, inp["article_id"]),
+        }
+        for width in CAPTURE_WIDTHS
+    ]
+    result = {key: inp[key] for key in ("key", "article_id", "revision", "chunk_no", "num_chunks")}
+    result.update(status="done", html=inp["html"], modified_html=inp["key"], samples=samples)
+    return result
+
+
+def test_page_widths_share_split(tmp_path, monkeypatch):
+    (tmp_path / "raw").mkdir()
+    (tmp_path / "raw" / RAW_PATH.name).symlink_to(RAW_PATH)
+    monkeypatch.setattr(wikipedia, "mp_job", fake_mp_job)
+    monkeypatch.setattr(wikipedia, "get_version_str", lambda *args: "splits")
+    monkeypatch.setattr(wikipedia, "visualize", lambda *args, **kwargs: None)
+    wikipedia.main(workspace=tmp_path, target_lang="de", num_train=3, num_val=1, num_test=1, debug=True)
+
+    pages = {}
+    for mode in ("train", "val", "test"):
+        lmdb = WebvicobLMDB(tmp_path / "splits" / mode, readonly=True, verbose=False)
+        for idx in range(lmdb.get_num_data()):
+            assert lmdb.get(encode(f"{idx}_img_{FINAL_WIDTH}")) is not None
+            pages.setdefault(lmdb.get_html(idx), []).append(mode)
+        lmdb.env.close()
+    assert len(pages) == 5
+    assert all(modes in (["train"] * 2, ["val"] * 2, ["test"] * 2) for modes in pages.values())
@@ -0,0 +1,13 @@
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+HEAVY_MODULES = ["matplotlib", "shapely", "pygame", "fire"]
+
+
+def test_lazy_imports():
+    script = f"import sys, webvicob.wikipedia.wikipedia; print([m for m in {HEAVY_MODULES} if m in sys.modules])"
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=dirname(dirname(abspath(__file__))))
+    assert output.decode().strip().splitlines()[-1] == "[]"
@@ -0,0 +1,88 @@
+import shutil
+import subprocess
+import sys
+import time
+from os.path import abspath, dirname
+
+import psutil
+import pytest
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from webvicob.wikipedia.watchdog import (
+    DEFAULT_STAGE_DEADLINES,
+    Quarantine,
+    StageTimeout,
+    StageWatchdog,
+    get_stage_deadlines,
+    kill_chrome_processes,
+)
+
+
+def test_stage_timeout():
+    watchdog = StageWatchdog({"load": 0.2}, poll_interval=0.05)
+    try:
+        with watchdog.stage("driver"):
+            pass
+        with pytest.raises(StageTimeout) as e:
+            with watchdog.stage("load"):
+                time.sleep(0.5)  # a hung selenium call
+        assert e.value.stage == "load"
+        assert watchdog.timed_out_stage == "load"
+    finally:
+        watchdog.close()
+
+
+def test_stage_timeout_chained():
+    # the blocked call fails once chrome is killed, the error is reported as the timeout of the stage.
+    watchdog = StageWatchdog({"js": 0.1}, poll_interval=0.05)
+    try:
+        with pytest.raises(StageTimeout) as e:
+            with watchdog.stage("js"):
+                time.sleep(0.3)
+                raise ConnectionError("chrome not reachable")
+        assert isinstance(e.value.__cause__, ConnectionError)
+    finally:
+        watchdog.close()
+
+
+def test_get_stage_deadlines():
+    assert get_stage_deadlines() == DEFAULT_STAGE_DEADLINES
+    deadlines = get_stage_deadlines({"capture": 5})
+    assert deadlines["capture"] == 5
+    assert deadlines["load"] == DEFAULT_STAGE_DEADLINES["load"]
+    with pytest.raises(AssertionError):
+        get_stage_deadlines({"render": 5})
+
+
+def test_kill_chrome_processes(tmp_path):
+    shutil.copy(shutil.which("sleep"), tmp_path / "chrome")
+    chrome = subprocess.Popen([str(tmp_path / "chrome"), "30"])
+    other = subprocess.Popen([shutil.which("sleep"), "30"])
+    try:
+        while psutil.Process(chrome.pid).name() != "chrome":  # until exec
+            time.sleep(0.01)
+        kill_chrome_processes()
+        chrome.wait(timeout=5)  # reaped by kill_chrome_processes, raises TimeoutExpired if still running
+        assert other.poll() is None
+    finally:
+        chrome.kill()
+        other.kill()
+        other.wait()
+
+
+def test_quarantine(tmp_path):
+    path = tmp_path / "quarantine.json"
+    quarantine = Quarantine(path, max_strikes=2)
+    quarantine.strike("dewiki_0.ndjson/1")
+    assert "dewiki_0.ndjson/1" not in quarantine
+
+    quarantine = Quarantine(path, max_strikes=2)  # strikes persist across runs
+    assert quarantine.strikes == {"dewiki_0.ndjson/1": 1}
+    quarantine.strike("dewiki_0.ndjson/1")
+    assert "dewiki_0.ndjson/1" in quarantine
+    assert "dewiki_0.ndjson/2" not in quarantine
+
+    assert "dewiki_0.ndjson/1" in Quarantine(path, max_strikes=2)
+    assert "dewiki_0.ndjson/1" not in Quarantine(path, max_strikes=3)
+    assert "dewiki_0.ndjson/1" not in Quarantine(path, max_strikes=None)
@@ -0,0 +1,118 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import time
+from collections import defaultdict
+
+import zstandard
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"  # never a prefix of valid utf-8 text
+HTML_KINDS = ("raw_html", "html")
+
+
+class HtmlCompressor:
+    """zstd compression of html values with one trained dictionary per html kind.
+
+    The first `num_train_samples` values of each kind are written plain, a dictionary is trained on them and
+    stored in the lmdb under `zstd_dict_{kind}`, then they are rewritten compressed. An interrupted build
+    keeps them plain. Values are decompressed transparently, plain (uncompressed) values are returned as is.
+    """
+
+    def __init__(self, lmdb, level=3, dict_size=112640, num_train_samples=256):
+        self.lmdb = lmdb
+        self.level = level
+        self.dict_size = dict_size
+        self.num_train_samples = num_train_samples
+
+        self.pending = {kind: [] for kind in HTML_KINDS}  # kind -> keys of values written plain
+        self.compressors = {}
+        self.decompressors = {}
+        self.stats = defaultdict(float)
+
+    def put(self, kind, key, value):
+        if kind not in self.compressors:
+            self.lmdb.put(key, value)
+            self.pending[kind].append(key)
+            if len(self.pending[kind]) >= self.num_train_samples:
+                self.flush(kind)
+            return
+
+        self.lmdb.put(key, self.compress(kind, value))
+
+    def get(self, kind, key):
+        value = self.lmdb.get(key)
+        if value is None or not value.startswith(ZSTD_MAGIC):
+            return value
+
+        return self.measure_decode(self.get_decompressor(kind), value)
+
+    def measure_decode(self, decompressor, value):
+        start = time.perf_counter()
+        value = decompressor.decompress(value)
+        self.stats["decode_seconds"] += time.perf_counter() - start
+        self.stats["num_decoded"] += 1
+        return value
+
+    def flush(self, kind=None):
+        kinds = HTML_KINDS if kind is None else [kind]
+        for kind in kinds:
+            if kind in self.compressors:
+                continue
+            pending, self.pending[kind] = self.pending[kind], []
+            samples = [bytes(self.lmdb.get(key)) for key in pending]
+            dict_data = self.train(kind, samples)
+            decompressor = zstandard.ZstdDecompressor(dict_data=to_zstd_dict(dict_data))
+            for key, value in zip(pending, samples):
+                compressed = self.compress(kind, value)
+                self.lmdb.put(key, compressed)
+                self.measure_decode(decompressor, compressed)
+
+    def train(self, kind, samples):
+        dict_data = b""
+        if len(samples) > 0:
+            start = time.perf_counter()
+            try:
+                dict_data = zstandard.train_dictionary(self.dict_size, samples, level=self.level).as_bytes()
+            except zstandard.ZstdError:
+                # too few or too small samples, compress without dictionary.
+                dict_data = b""
+            self.stats["train_seconds"] += time.perf_counter() - start
+
+        self.lmdb.put(f"zstd_dict_{kind}".encode("utf-8"), dict_data)
+        self.compressors[kind] = zstandard.ZstdCompressor(level=self.level, dict_data=to_zstd_dict(dict_data))
+        return dict_data
+
+    def compress(self, kind, value):
+        start = time.perf_counter()
+        compressed = self.compressors[kind].compress(value)
+        self.stats["encode_seconds"] += time.perf_counter() - start
+        self.stats["num_encoded"] += 1
+        self.stats["raw_bytes"] += len(value)
+        self.stats["compressed_bytes"] += len(compressed)
+        return compressed
+
+    def get_decompressor(self, kind):
+        if kind not in self.decompressors:
+            dict_data = self.lmdb.get(f"zstd_dict_{kind}".encode("utf-8"))
+            self.decompressors[kind] = zstandard.ZstdDecompressor(dict_data=to_zstd_dict(dict_data))
+        return self.decompressors[kind]
+
+    def report(self):
+        stats = self.stats
+        ratio = stats["raw_bytes"] / max(stats["compressed_bytes"], 1)
+        encode_us = stats["encode_seconds"] / max(stats["num_encoded"], 1) * 1e6
+        decode_us = stats["decode_seconds"] / max(stats["num_decoded"], 1) * 1e6
+        return (
+            f"html compression ratio {ratio:.2f} ({stats['raw_bytes'] / 1024**2:.1f} MiB -> "
+            f"{stats['compressed_bytes'] / 1024**2:.1f} MiB), encode {encode_us:.0f} us/value, "
+            f"decode {decode_us:.0f} us/value ({stats['num_decoded']:.0f} values), "
+            f"dictionary training {stats['train_seconds']:.1f}s"
+        )
+
+
+def to_zstd_dict(dict_data):
+    if not dict_data:
+        return None
+    return zstandard.ZstdCompressionDict(bytes(dict_data))
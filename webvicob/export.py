@@ -0,0 +1,151 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import io
+import json
+import multiprocessing as mp
+import os
+import random
+import tarfile
+import time
+from pathlib import Path
+
+import fire
+
+from webvicob.image_codec import detect_codec
+from webvicob.lmdb_reader import WebvicobLMDBReader
+
+EXPORT_FORMATS = {"webdataset": "tar", "parquet": "parquet"}
+IMAGE_EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+INDEX_FILE = "index.json"
+READ_BATCH_SIZE = 64
+
+reader = None
+
+
+def export(lmdb_path, out_dir, export_format="webdataset", shard_size=1000, num_process=-1, seed=0, shuffle=True):
+    """Stream a finished WebvicobLMDB split into fixed-size shards for sequential reads.
+
+    Samples are shuffled once with `seed` and cut into shards of `shard_size` samples, so every shard is a
+    random subset and a loader only has to shuffle the shard order (and within a small buffer).
+    webdataset: `{idx:09d}.{jpg,png,webp}` (the codec of the stored image) + `{idx:09d}.json` (annots) per sample.
+    parquet: columns idx, image, codec ("jpeg", "png", "webp"), annots (json string), one row group per read batch.
+    """
+    assert export_format in EXPORT_FORMATS, f"export_format should be one of {list(EXPORT_FORMATS)}"
+    if num_process == -1:
+        num_process = os.cpu_count()
+
+    lmdb_path = Path(lmdb_path)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    num_data = WebvicobLMDBReader(lmdb_path).get_num_data()
+    indices = list(range(num_data))
+    if shuffle:
+        random.Random(seed).shuffle(indices)
+    jobs = []
+    for shard_no, start in enumerate(range(0, num_data, shard_size)):
+        shard_name = f"{lmdb_path.name}-{shard_no:06d}.{EXPORT_FORMATS[export_format]}"
+        jobs.append((str(out_dir / shard_name), export_format, indices[start : start + shard_size]))
+
+    start_time = time.time()
+    with mp.get_context("spawn").Pool(num_process, initializer=init_reader, initargs=(str(lmdb_path),)) as pool:
+        shards = []
+        for shard in pool.imap(write_shard, jobs):
+            shards.append(shard)
+            print(f"[{len(shards)} / {len(jobs)}] {shard['name']} ({shard['num_samples']} samples)", flush=True)
+
+    verify_shards(shards, out_dir, export_format, num_data)
+    index = {
+        "source": str(lmdb_path.resolve()),
+        "format": export_format,
+        "num_samples": num_data,
+        "shard_size": shard_size,
+        "seed": seed if shuffle else None,
+        "shards": shards,
+    }
+    (out_dir / INDEX_FILE).write_text(json.dumps(index))
+    print(f"exported {num_data} samples into {len(shards)} shards in {time.time() - start_time:.1f}s. ({out_dir})")
+
+
+def init_reader(lmdb_path):
+    global reader
+    reader = WebvicobLMDBReader(lmdb_path)
+
+
+def iter_batches(indices):
+    for start in range(0, len(indices), READ_BATCH_SIZE):
+        # views of the memory map, written to the shard before the next batch
+        yield reader.getmulti_samples(indices[start : start + READ_BATCH_SIZE], decode=False, copy=False)
+
+
+def write_shard(job):
+    shard_path, export_format, indices = job
+    shard_path = Path(shard_path)
+    tmp_path = shard_path.with_name(shard_path.name + ".tmp")
+    if export_format == "webdataset":
+        write_tar_shard(tmp_path, indices)
+    else:
+        write_parquet_shard(tmp_path, indices)
+    tmp_path.rename(shard_path)  # partially written shards never look finished
+    return {"name": shard_path.name, "num_samples": len(indices), "indices": indices}
+
+
+def write_tar_shard(path, indices):
+    with tarfile.open(path, "w") as tar:
+        for samples in iter_batches(indices):
+            for sample in samples:
+                img = sample["img"].tobytes()
+                annots = json.dumps(sample["annots"], ensure_ascii=False).encode("utf-8")
+                add_tar_member(tar, f"{sample['idx']:09d}.{IMAGE_EXTENSIONS[detect_codec(img)]}", img)
+                add_tar_member(tar, f"{sample['idx']:09d}.json", annots)
+
+
+def add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_parquet_shard(path, indices):
+    # Optional dependency, only needed for parquet export.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("idx", pa.int64()), ("image", pa.binary()), ("codec", pa.string()), ("annots", pa.string())])
+    with pq.ParquetWriter(path, schema) as writer:
+        for samples in iter_batches(indices):
+            imgs = [sample["img"].tobytes() for sample in samples]
+            batch = {
+                "idx": [sample["idx"] for sample in samples],
+                "image": imgs,
+                "codec": [detect_codec(img) for img in imgs],
+                "annots": [json.dumps(sample["annots"], ensure_ascii=False) for sample in samples],
+            }
+            writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+
+
+def count_shard_samples(path, export_format):
+    if export_format == "webdataset":
+        with tarfile.open(path) as tar:
+            return sum(1 for member in tar.getmembers() if member.name.endswith(".json"))
+
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def verify_shards(shards, out_dir, export_format, num_data):
+    exported = set()
+    for shard in shards:
+        num_samples = count_shard_samples(out_dir / shard["name"], export_format)
+        assert num_samples == shard["num_samples"], f"{shard['name']}: {num_samples} != {shard['num_samples']}"
+        exported.update(shard["indices"])
+    assert exported == set(range(num_data)), f"{len(exported)} samples exported, but get_num_data() is {num_data}"
+
+
+if __name__ == "__main__":
+    fire.Fire(export)
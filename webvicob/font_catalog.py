@@ -0,0 +1,198 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+CATALOG_VERSION = 1
+
+# A font supports a script if it has glyphs for every sample character.
+SCRIPT_SAMPLES = {
+    "latin": "AaZz",
+    "greek": "ΑΩαω",
+    "cyrillic": "ЖЯжя",
+    "arabic": "بعم",
+    "hebrew": "אשת",
+    "devanagari": "अकम",
+    "thai": "กขม",
+    "han": "中文字",
+    "hiragana": "あいう",
+    "katakana": "アイウ",
+    "hangul": "한글가",
+}
+
+# wikipedia language -> scripts a font needs for its pages. Languages not listed are not filtered.
+LANG_SCRIPTS = {
+    "en": ["latin"],
+    "de": ["latin"],
+    "fr": ["latin"],
+    "es": ["latin"],
+    "it": ["latin"],
+    "pt": ["latin"],
+    "nl": ["latin"],
+    "pl": ["latin"],
+    "vi": ["latin"],
+    "el": ["greek"],
+    "ru": ["cyrillic"],
+    "uk": ["cyrillic"],
+    "bg": ["cyrillic"],
+    "ar": ["arabic"],
+    "fa": ["arabic"],
+    "he": ["hebrew"],
+    "hi": ["devanagari"],
+    "mr": ["devanagari"],
+    "th": ["thai"],
+    "zh": ["han"],
+    "ja": ["han", "hiragana", "katakana"],
+    "ko": ["hangul"],
+}
+
+
+def get_catalog_path(font_dir_path):
+    """font/google ==> font/google_catalog.json (outside of the font submodule)."""
+    font_dir_path = Path(font_dir_path).resolve()
+    return font_dir_path.with_name(f"{font_dir_path.name}_catalog.json")
+
+
+def build_font_catalog(font_dir_path="font/google", catalog_path=None, num_process=-1):
+    """Scan every ttf under `font_dir_path` once, validate it with freetype and save the catalog.
+
+    Fonts of an existing catalog are reused if their file size and mtime are unchanged.
+    """
+    if num_process == -1:
+        num_process = os.cpu_count()
+    font_dir_path = Path(font_dir_path).resolve()
+    catalog_path = Path(catalog_path) if catalog_path is not None else get_catalog_path(font_dir_path)
+
+    previous = {}
+    if catalog_path.exists():
+        catalog = json.loads(catalog_path.read_text())
+        if catalog["version"] == CATALOG_VERSION:
+            previous = {font["path"]: font for font in catalog["fonts"]}
+
+    font_files = list_font_files(font_dir_path)
+    fonts, jobs = [], []
+    for path, size, mtime in font_files:
+        font = previous.get(path)
+        if font is not None and font["size"] == size and font["mtime"] == mtime:
+            fonts.append(font)
+        else:
+            jobs.append(str(font_dir_path / path))
+
+    start_time = time.time()
+    if len(jobs) > 0:
+        with mp.get_context("spawn").Pool(num_process) as pool:
+            for font in pool.imap_unordered(inspect_font, jobs, chunksize=16):
+                font["path"] = str(Path(font["path"]).relative_to(font_dir_path))
+                fonts.append(font)
+    fonts.sort(key=lambda font: font["path"])
+
+    catalog = {
+        "version": CATALOG_VERSION,
+        "font_dir": str(font_dir_path),
+        "fingerprint": get_fingerprint(font_files),
+        "fonts": fonts,
+    }
+    # written next to the catalog and moved into place, so concurrent readers never see a partial file.
+    tmp_path = catalog_path.with_name(f"{catalog_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(catalog, ensure_ascii=False, separators=(",", ":")))
+    os.replace(tmp_path, catalog_path)
+    num_valid = sum(font["valid"] for font in fonts)
+    print(
+        f"font catalog {catalog_path}: {num_valid} / {len(fonts)} valid fonts, "
+        f"{len(jobs)} inspected in {time.time() - start_time:.1f}s"
+    )
+
+
+def list_font_files(font_dir_path):
+    """(path relative to `font_dir_path`, size, mtime) of every ttf, sorted by path."""
+    font_files = []
+    for p in sorted(font_dir_path.glob("**/*.ttf")):
+        stat = p.stat()
+        font_files.append((str(p.relative_to(font_dir_path)), stat.st_size, stat.st_mtime))
+    return font_files
+
+
+def get_fingerprint(font_files):
+    """Changes when a font is added, removed or modified."""
+    return hashlib.sha1(json.dumps(font_files).encode("utf-8")).hexdigest()
+
+
+def inspect_font(font_path):
+    from pygame import freetype
+
+    stat = Path(font_path).stat()
+    font = {"path": font_path, "size": stat.st_size, "mtime": stat.st_mtime, "valid": False}
+    try:
+        if not freetype.was_init():
+            freetype.init()
+        ft_font = freetype.Font(font_path)
+        scripts = [
+            script
+            for script, sample in SCRIPT_SAMPLES.items()
+            if all(metrics is not None for metrics in ft_font.get_metrics(sample, size=100))
+        ]
+        font.update(
+            family=ft_font.name,
+            ascender=ft_font.ascender,
+            descender=ft_font.descender,
+            height=ft_font.height,
+            fixed_width=bool(ft_font.fixed_width),
+            scripts=scripts,
+        )
+
+        if not ft_font.scalable:
+            font["error"] = "not scalable"
+        elif len(scripts) == 0:
+            font["error"] = "no supported script"
+        elif ft_font.get_rect(SCRIPT_SAMPLES[scripts[0]][0], size=100).height <= 0:
+            font["error"] = "empty glyph"
+        else:
+            font["valid"] = True
+    except Exception as e:
+        font["error"] = repr(e)
+    return font
+
+
+def load_font_paths(font_dir_path="font/google", catalog_path=None, scripts=None):
+    """Absolute paths of valid fonts in the catalog. The catalog is built first if it does not exist, and rebuilt
+    if the fonts under `font_dir_path` changed since.
+
+    scripts: keep only fonts supporting every given script. (e.g. ["latin", "han"])
+    """
+    if not Path(font_dir_path).is_dir():
+        print(f"font directory {font_dir_path} does not exist.")
+        return []
+
+    catalog_path = Path(catalog_path) if catalog_path is not None else get_catalog_path(font_dir_path)
+    catalog = None
+    if catalog_path.exists():
+        catalog = json.loads(catalog_path.read_text())
+    if (
+        catalog is None
+        or catalog["version"] != CATALOG_VERSION
+        or catalog.get("fingerprint") != get_fingerprint(list_font_files(Path(font_dir_path).resolve()))
+    ):
+        build_font_catalog(font_dir_path, catalog_path)
+        catalog = json.loads(catalog_path.read_text())
+
+    font_dir = Path(catalog["font_dir"])
+    return [
+        str(font_dir / font["path"])
+        for font in catalog["fonts"]
+        if font["valid"] and (scripts is None or set(scripts) <= set(font["scripts"]))
+    ]
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(build_font_catalog)
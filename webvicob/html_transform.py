@@ -0,0 +1,142 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import unicodedata
+
+from bs4 import BeautifulSoup, element
+
+# Bump whenever the output of `modify_html` changes. Derived htmls of older versions can not be regenerated.
+HTML_TRANSFORM_VERSION = 1
+
+# Inline styles hiding elements get "important" priority, so that no later style can show them again.
+INVISIBLE_INLINE_STYLES = [
+    ("*[style*='display: none'], *[style*='display:none']", "display", "none"),
+    ("*[style*='visibility: hidden'], *[style*='visibility:hidden']", "visibility", "hidden"),
+    ("*[style*='visibility: collapse'], *[style*='visibility:collapse']", "visibility", "collapse"),
+    ("*[style*='opacity: 0'], *[style*='opacity:0']", "opacity", "0"),
+]
+
+REMOVE_SELECTORS = ["label"]
+
+BORDER_BOTTOM_STYLE = """
+    h1, h2, h3 {
+        border-bottom: none !important;
+    }
+"""
+
+# https://developer.mozilla.org/en-US/docs/Web/CSS/Pseudo-elements
+PSEUDO_ELEMENT_STYLE = """
+    *::before, *::after, ol *::marker {
+        content: none !important;
+    }
+    *::placeholder {
+        opacity: 0 !important;
+    }
+"""
+
+BACKGROUND_IMAGE_STYLE = """
+    * {
+        background-image: none !important;
+    }
+"""
+
+POSITION_STYLE = """
+    * {
+        position: static !important;
+    }
+"""
+
+FLOAT_STYLE = """
+    * {
+        float: none !important;
+    }
+"""
+
+# https://flexboxfroggy.com/
+FLEXBOX_STYLE = """
+    * {
+        flex-flow: row wrap !important;
+        order: 0 !important;
+    }
+"""
+
+
+def get_html_transform(opt):
+    return {
+        "version": HTML_TRANSFORM_VERSION,
+        "bake_styles": opt["bake_styles"],
+        "remove_background": opt["remove_background"],
+        "unroll_contents": opt["unroll_contents"],
+        "char_spans": opt.get("char_boxes", "span") == "span",
+    }
+
+
+def modify_html(html, bake_styles=False, remove_background=True, unroll_contents=False, char_spans=True):
+    """Wrap characters with ocr-char spans. (`char_spans`, text is left intact for char_boxes="range")
+
+    If `bake_styles`, static style rewrites of `execute_js` (inline priority of invisible elements, label removal
+    and page styles) are applied here in the same parsing pass, so the browser lays out the page only once.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    if bake_styles:
+        bake_page_styles(soup, remove_background, unroll_contents)
+    if char_spans:
+        add_boxes_to_soup(soup)
+    return str(soup)
+
+
+def bake_page_styles(soup, remove_background, unroll_contents):
+    for selector, key, value in INVISIBLE_INLINE_STYLES:
+        for elem in soup.select(selector):
+            elem["style"] = f"{elem['style'].strip().rstrip(';')}; {key}: {value} !important"
+
+    for selector in REMOVE_SELECTORS:
+        for elem in soup.select(selector):
+            elem.decompose()
+
+    style = soup.new_tag("style")
+    style.string = "".join(get_page_styles(remove_background, unroll_contents))
+    (soup.head or soup).append(style)
+
+
+def add_boxes_to_soup(soup):
+    def _add_boxes(soup, elem):
+        if isinstance(elem, element.NavigableString):
+            tags = []
+
+            for char in elem.text:
+                # ignore control character
+                category = unicodedata.category(char)
+                if category.startswith("C"):
+                    continue
+
+                tag = char
+                if char.strip() != "":
+                    tag = soup.new_tag("span", attrs={"class": "ocr-char"})
+                    tag.string = unicodedata.normalize("NFKC", char)
+
+                tags.append(tag)
+
+            elem.replace_with(*tags)
+            return None
+
+        if isinstance(elem, element.Tag) and elem.name == "svg":
+            return None
+
+        children = list(elem.children)
+
+        for child in children:
+            _add_boxes(soup, child)
+
+    _add_boxes(soup, soup.body)
+
+
+def get_page_styles(remove_background, unroll_contents):
+    styles = [PSEUDO_ELEMENT_STYLE, BORDER_BOTTOM_STYLE]
+    if remove_background:
+        styles.append(BACKGROUND_IMAGE_STYLE)
+    if unroll_contents:
+        styles += [POSITION_STYLE, FLOAT_STYLE, FLEXBOX_STYLE]
+    return styles
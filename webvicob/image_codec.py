@@ -0,0 +1,137 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import random
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from webvicob.lmdb_reader import WebvicobLMDBReader
+
+IMAGE_CODECS = ("jpeg", "webp", "png")
+JPEG_SUBSAMPLINGS = {
+    "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+    "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+}
+WEBP_MAX_SIZE = 16383
+PNG_COMPRESSION = 3  # zlib level. higher levels are much slower for little gain on screenshots
+
+BENCHMARK_CODECS = [
+    {"codec": "jpeg", "quality": 95, "subsampling": None},
+    {"codec": "jpeg", "quality": 90, "subsampling": "420"},
+    {"codec": "jpeg", "quality": 95, "subsampling": "444"},
+    {"codec": "webp", "quality": 90, "subsampling": None},
+    {"codec": "webp", "quality": 101, "subsampling": None},  # lossless
+    {"codec": "png", "quality": None, "subsampling": None},
+]
+
+
+def get_image_codec(codec="jpeg", quality=95, subsampling=None):
+    """Image codec of stored images.
+
+    jpeg: quality 0 ~ 100, subsampling one of "444", "422", "420" (None ==> encoder default).
+    webp: quality 1 ~ 100, above 100 ==> lossless.
+    png: lossless, quality is ignored.
+    """
+    assert codec in IMAGE_CODECS, f"image_codec should be one of {IMAGE_CODECS}"
+    if subsampling is not None:
+        subsampling = str(subsampling)
+        assert codec == "jpeg", "subsampling is only for jpeg"
+        assert subsampling in JPEG_SUBSAMPLINGS, f"jpeg_subsampling should be one of {list(JPEG_SUBSAMPLINGS)}"
+    return {"codec": codec, "quality": quality, "subsampling": subsampling}
+
+
+def is_native_capture(image_codec):
+    """Chrome encodes plain jpeg captures itself. Other codecs are captured as png and encoded in the worker."""
+    return image_codec is None or (image_codec["codec"] == "jpeg" and image_codec["subsampling"] is None)
+
+
+def encode_img(img, image_codec=None):
+    if image_codec is None:
+        image_codec = get_image_codec()
+    codec = image_codec["codec"]
+    if codec == "jpeg":
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), image_codec["quality"]]
+        if image_codec["subsampling"] is not None:
+            params += [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), JPEG_SUBSAMPLINGS[image_codec["subsampling"]]]
+        ok, buffer = cv2.imencode(".jpg", img, params)
+    elif codec == "webp":
+        assert max(img.shape[:2]) <= WEBP_MAX_SIZE, f"webp images should be at most {WEBP_MAX_SIZE} px"
+        ok, buffer = cv2.imencode(".webp", img, [int(cv2.IMWRITE_WEBP_QUALITY), image_codec["quality"]])
+    else:
+        ok, buffer = cv2.imencode(".png", img, [int(cv2.IMWRITE_PNG_COMPRESSION), PNG_COMPRESSION])
+    assert ok, f"failed to encode {image_codec}"
+    return buffer
+
+
+def detect_codec(img_buffer):
+    header = bytes(img_buffer[:12])
+    if header[:2] == b"\xff\xd8":
+        return "jpeg"
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def is_lossless(img_buffer):
+    """png, or webp with a VP8L (lossless) bitstream."""
+    codec = detect_codec(img_buffer)
+    return codec == "png" or (codec == "webp" and bytes(img_buffer[12:16]) == b"VP8L")
+
+
+def benchmark_codecs(lmdb_path, num_samples=50, seed=0):
+    """bytes/sample, encode and decode ms/sample of each codec in BENCHMARK_CODECS, on lossless captures.
+
+    Re-encoding lossy images would measure the artifacts of their codec, so only lossless images are used:
+    the full size capture (`{idx}_capture`, saved with `save_box_records` if the image was resized) or the image of
+    splits built with `image_codec="png"`.
+    """
+    reader = WebvicobLMDBReader(Path(lmdb_path))
+    num_data = reader.get_num_data()
+    indices = random.Random(seed).sample(range(num_data), min(num_samples, num_data))
+    imgs, num_lossy = [], 0
+    for idx in indices:
+        buffer = reader.get(f"{idx}_capture".encode("utf-8"))
+        if buffer is None:
+            buffer = reader.get(f"{idx}_img".encode("utf-8"))
+        if not is_lossless(buffer):
+            num_lossy += 1
+            continue
+        imgs.append(cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR))
+    reader.close()
+    assert len(imgs) > 0, f"no lossless captures in {lmdb_path}, build a sample of pages with image_codec='png'"
+    if num_lossy > 0:
+        print(f"{num_lossy} lossy samples skipped")
+    imgs = [img for img in imgs if max(img.shape[:2]) <= WEBP_MAX_SIZE]
+
+    print(f"{len(imgs)} samples, mean {np.mean([img.shape[0] for img in imgs]):.0f} px height")
+    print(f"{'codec':<28}{'KiB/sample':>12}{'encode ms':>12}{'decode ms':>12}")
+    for image_codec in BENCHMARK_CODECS:
+        num_bytes, encode_seconds, decode_seconds = 0, 0.0, 0.0
+        for img in imgs:
+            start = time.perf_counter()
+            buffer = encode_img(img, image_codec)
+            encode_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+            decode_seconds += time.perf_counter() - start
+            num_bytes += len(buffer)
+
+        name = "/".join(str(v) for v in image_codec.values() if v is not None)
+        print(
+            f"{name:<28}{num_bytes / len(imgs) / 1024:>12.1f}"
+            f"{encode_seconds / len(imgs) * 1e3:>12.1f}{decode_seconds / len(imgs) * 1e3:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(benchmark_codecs)
@@ -5,24 +5,58 @@ Apache-2.0
 """
 import json
 import os
+from collections import OrderedDict
 from pathlib import Path
 
 import cv2
 import lmdb
 import numpy as np
 
+from webvicob.compression import HTML_KINDS, HtmlCompressor
+from webvicob.html_transform import HTML_TRANSFORM_VERSION, modify_html
+from webvicob.spatial import (
+    build_spatial_index,
+    crop_annots,
+    pack_spatial_index,
+    unpack_spatial_index,
+)
+
 LMDB_MAP_SIZE = 10 * 1024**4  # 10 TiB
 COMMIT_INTERVAL = 100
+HTML_STORAGES = ("full", "derived")
 
 
 class WebvicobLMDB:
-    def __init__(self, lmdb_path: Path, readonly=False, verbose=True):
+    def __init__(
+        self,
+        lmdb_path: Path,
+        readonly=False,
+        verbose=True,
+        html_compression=None,
+        html_storage="full",
+        html_cache_size=32,
+        spatial_index=False,
+    ):
         lmdb_path.parent.mkdir(parents=True, exist_ok=True)
         self.lmdb_path = str(lmdb_path)
         self.env = lmdb.open(self.lmdb_path, map_size=LMDB_MAP_SIZE, readonly=readonly)
         os.system(f"chmod -R 777 {self.lmdb_path}")
         self.verbose = verbose
 
+        # Compressed html values are decoded transparently, whatever `html_compression` is.
+        assert html_compression in (None, "zstd"), "html_compression should be None or 'zstd'"
+        self.html_compression = html_compression
+        self.html_compressor = HtmlCompressor(self)
+
+        # "derived": modified html is not stored, `get_html` regenerates it from the raw html and its transform.
+        assert html_storage in HTML_STORAGES, f"html_storage should be one of {HTML_STORAGES}"
+        self.html_storage = html_storage
+        self.html_cache = OrderedDict()
+        self.html_cache_size = html_cache_size
+
+        # per-sample index of word/image/table/paragraph boxes for `get_crop`
+        self.spatial_index = spatial_index
+
         if verbose:
             print(f"{self.lmdb_path} LMDB_DUMP started.")
 
@@ -31,23 +65,107 @@ class WebvicobLMDB:
             value = txn.get(key)
         return value
 
+    def get_html_idx(self, idx):
+        """Sample storing the html of `idx`. Samples captured from one page load (`multi_width_capture`) share it."""
+        ref = self.get(encode(f"{idx}_html_ref"))
+        return idx if ref is None else int(decode(ref))
+
     def get_raw_html(self, idx):
-        return decode(self.get(encode(f"{idx}_raw_html")))
+        idx = self.get_html_idx(idx)
+        return decode(self.html_compressor.get("raw_html", encode(f"{idx}_raw_html")))
 
     def get_html(self, idx):
-        return decode(self.get(encode(f"{idx}_html")))
+        idx = self.get_html_idx(idx)
+        html = self.html_compressor.get("html", encode(f"{idx}_html"))
+        if html is not None:
+            return decode(html)
+        return self.derive_html(idx)
+
+    def get_html_transform(self, idx):
+        idx = self.get_html_idx(idx)
+        transform = self.get(encode(f"{idx}_html_transform"))
+        return None if transform is None else json.loads(decode(transform))
+
+    def derive_html(self, idx):
+        """Regenerate the modified html of `idx` from its raw html. Recently derived htmls are cached."""
+        idx = self.get_html_idx(idx)
+        if idx in self.html_cache:
+            self.html_cache.move_to_end(idx)
+            return self.html_cache[idx]
 
-    def get_img(self, idx):
-        jpeg_read = self.get(encode(f"{idx}_img"))
+        transform = self.get_html_transform(idx)
+        if transform is None:
+            return None
+        if transform["version"] != HTML_TRANSFORM_VERSION:
+            raise ValueError(
+                f"html of {idx} was made by html transform version {transform['version']}, but current version is "
+                f"{HTML_TRANSFORM_VERSION}. Derive it with a matching webvicob version."
+            )
+        html = modify_html(
+            self.get_raw_html(idx),
+            transform["bake_styles"],
+            transform["remove_background"],
+            transform["unroll_contents"],
+            transform.get("char_spans", True),
+        )
+
+        self.html_cache[idx] = html
+        if len(self.html_cache) > self.html_cache_size:
+            self.html_cache.popitem(last=False)
+        return html
+
+    def get_img(self, idx, width=None):
+        jpeg_read = self.get(encode(get_variant_key(idx, "img", width)))
         jpeg_read = np.frombuffer(jpeg_read, dtype=np.uint8)
         img = cv2.imdecode(jpeg_read, cv2.IMREAD_COLOR)
         return img
 
-    def get_annots(self, idx):
-        annots = self.get(encode(f"{idx}_annots"))
+    def get_annots(self, idx, width=None):
+        annots = self.get(encode(get_variant_key(idx, "annots", width)))
         annots = json.loads(decode(annots))
         return annots
 
+    def get_variant_widths(self, idx):
+        """Extra final widths stored for `idx`. (`final_width` list)"""
+        prefix = encode(get_variant_key(idx, "img", ""))
+        widths = []
+        with self.env.begin(write=False) as txn:
+            cursor = txn.cursor()
+            if cursor.set_range(prefix):
+                for key in cursor.iternext(values=False):
+                    if not key.startswith(prefix):
+                        break
+                    widths.append(int(decode(key[len(prefix) :])))
+        return widths
+
+    def get_box_record(self, idx):
+        """(box record, captured jpeg) of `idx`. The capture is the stored img unless it was resized."""
+        box_record = self.get(encode(f"{idx}_box_record"))
+        if box_record is None:
+            return None, None
+        capture = self.get(encode(f"{idx}_capture"))
+        if capture is None:
+            capture = self.get(encode(f"{idx}_img"))
+        return json.loads(decode(box_record)), capture
+
+    def get_crop(self, idx, x0, y0, x1, y1):
+        """(image, annots) of the window [x0, x1) x [y0, y1), annots clipped and in crop coordinates.
+
+        Only the annotations found by the spatial index are parsed. Samples stored without the index
+        are indexed on the fly from `get_annots`.
+        """
+        index = self.get(encode(f"{idx}_spatial"))
+        if index is None:
+            index, annots_json = build_spatial_index(self.get_annots(idx))
+        else:
+            index, annots_json = unpack_spatial_index(index), self.get(encode(get_variant_key(idx, "annots", None)))
+
+        # opencv has no region decode for jpeg, the full image is decoded.
+        img = self.get_img(idx)
+        height, width = img.shape[:2]
+        x0, y0, x1, y1 = max(int(x0), 0), max(int(y0), 0), min(int(x1), width), min(int(y1), height)
+        return img[y0:y1, x0:x1], crop_annots(index, annots_json, x0, y0, x1, y1)
+
     def get_num_data(self):
         return int(self.get("num_data".encode()).decode())
 
@@ -55,27 +173,109 @@ class WebvicobLMDB:
         with self.env.begin(write=True) as txn:
             txn.put(key, value)
 
+    def delete_variant(self, idx, width):
+        with self.env.begin(write=True) as txn:
+            txn.delete(encode(get_variant_key(idx, "img", width)))
+            txn.delete(encode(get_variant_key(idx, "annots", width)))
+
     def put_raw_html(self, raw_html, idx):
-        self.put(encode(f"{idx}_raw_html"), encode(raw_html))
+        self.put_html_value("raw_html", raw_html, idx)
+
+    def put_html(self, html, idx, transform=None):
+        """`transform`: {"version", "bake_styles", "remove_background", "unroll_contents"} of `modify_html`."""
+        if transform is not None:
+            self.put(encode(f"{idx}_html_transform"), encode(json.dumps(transform)))
+            if self.html_storage == "derived":
+                return
+        self.put_html_value("html", html, idx)
+
+    def put_html_ref(self, src_idx, idx):
+        """Share the raw/modified html of `src_idx` with `idx`."""
+        self.put(encode(f"{idx}_html_ref"), encode(str(src_idx)))
+
+    def put_html_value(self, kind, html, idx):
+        if self.html_compression is None:
+            self.put(encode(f"{idx}_{kind}"), encode(html))
+        else:
+            self.html_compressor.put(kind, encode(f"{idx}_{kind}"), encode(html))
 
-    def put_html(self, html, idx):
-        self.put(encode(f"{idx}_html"), encode(html))
+    def put_img(self, img_buffer, idx, width=None):
+        self.put(encode(get_variant_key(idx, "img", width)), img_buffer)
 
-    def put_img(self, img_buffer, idx):
-        self.put(encode(f"{idx}_img"), img_buffer)
+    def put_annots(self, annots, idx, width=None):
+        """`width`: extra final width variant of the sample. (`final_width` list)"""
+        # an existing index is refreshed too, e.g. by reannotate.
+        if width is None and (self.spatial_index or self.get(encode(f"{idx}_spatial")) is not None):
+            index, annots_json = build_spatial_index(annots)  # offsets into the stored annots json
+            self.put(encode(f"{idx}_spatial"), pack_spatial_index(index))
+        else:
+            annots_json = encode(json.dumps(annots, ensure_ascii=False))
+        self.put(encode(get_variant_key(idx, "annots", width)), annots_json)
 
-    def put_annots(self, annots, idx):
-        self.put(encode(f"{idx}_annots"), encode(json.dumps(annots, ensure_ascii=False)))
+    def put_box_record(self, box_record, idx, capture=None):
+        self.put(encode(f"{idx}_box_record"), encode(json.dumps(box_record, ensure_ascii=False)))
+        if capture is not None:
+            self.put(encode(f"{idx}_capture"), capture)
+
+    def copy_sample(self, src, src_idx, idx, html_idx=None):
+        """Copy every value of sample `src_idx` of another WebvicobLMDB to `idx`.
+
+        `html_idx`: sample of this lmdb holding the html which `src_idx` refers to (`put_html_ref`), it is referred
+        to instead of copying the html again.
+        """
+        prefix = encode(f"{src_idx}_")
+        items = []
+        with src.env.begin(write=False) as txn:
+            cursor = txn.cursor()
+            if cursor.set_range(prefix):
+                for key, value in cursor:
+                    if not key.startswith(prefix):
+                        break
+                    items.append((decode(key[len(prefix) :]), value))
+
+        src_html_idx = src.get_html_idx(src_idx)
+        if src_html_idx != src_idx:
+            items = [(name, value) for name, value in items if name != "html_ref"]
+            if html_idx is not None:
+                self.put_html_ref(html_idx, idx)
+            else:
+                # the html is copied, `src_html_idx` is not copied to a known index.
+                transform = src.get(encode(f"{src_html_idx}_html_transform"))
+                if transform is not None:
+                    items.append(("html_transform", transform))
+                for name in HTML_KINDS:
+                    html = src.html_compressor.get(name, encode(f"{src_html_idx}_{name}"))
+                    if html is not None:
+                        self.put_html_value(name, decode(html), idx)
+
+        for name, value in items:
+            if name in HTML_KINDS:
+                # html may be compressed with the dictionary of `src`
+                html = src.html_compressor.get(name, encode(f"{src_idx}_{name}"))
+                self.put_html_value(name, decode(html), idx)
+            else:
+                self.put(encode(f"{idx}_{name}"), value)
 
     def put_num_data(self, num_data):
         self.put(encode("num_data"), encode(str(num_data)))
 
     def wrap_up(self):
+        if self.html_compression is not None:
+            self.html_compressor.flush()
         if self.verbose:
             print(f"{self.lmdb_path} LMDB_DUMPED. NUM_DATA: {self.get_num_data()}")
+            if self.html_compression is not None:
+                print(f"{self.lmdb_path} {self.html_compressor.report()}")
         self.env.close()
 
 
+def get_variant_key(idx, name, width=None):
+    """{idx}_img, {idx}_annots of the main sample, {idx}_img_{width}, {idx}_annots_{width} of extra widths."""
+    if width is None:
+        return f"{idx}_{name}"
+    return f"{idx}_{name}_{width}"
+
+
 def encode(string_data):
     return string_data.encode("utf-8")
 
@@ -0,0 +1,162 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import json
+import os
+
+import cv2
+import lmdb
+import numpy as np
+
+from webvicob.lmdb_maker import encode, get_variant_key
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class WebvicobLMDBReader:
+    """Read-only view of a finished WebvicobLMDB split for training data loaders.
+
+    The lmdb environment is opened lazily in each process (safe to pass to forked or spawned
+    DataLoader workers), and one read-only transaction is reused for every lookup of that process.
+    `get`/`getmulti` return memoryviews of the memory map, valid only until `close()` or until the transaction is
+    reopened (e.g. first read after a fork). Image buffers (`get_img_buffer`, `getmulti_samples(decode=False)`) are
+    copied by default; `copy=False` returns zero-copy views with the same lifetime, for callers consuming them at once.
+
+    Do not read a split with this class while `main()` is still writing it. (lock=False)
+    `width` selects an extra final width variant of the samples. (`final_width` list)
+    """
+
+    def __init__(self, lmdb_path, reduce_factor=1, max_readers=1024, width=None):
+        assert reduce_factor in REDUCED_DECODE_FLAGS, f"reduce_factor should be one of {list(REDUCED_DECODE_FLAGS)}"
+        self.lmdb_path = str(lmdb_path)
+        self.reduce_factor = reduce_factor
+        self.max_readers = max_readers
+        self.width = width
+
+        self._pid = None
+        self._env = None
+        self._txn = None
+        self._num_data = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_pid"] = None
+        state["_env"] = None
+        state["_txn"] = None
+        return state
+
+    def __len__(self):
+        return self.get_num_data()
+
+    def __getitem__(self, idx):
+        return self.get_sample(idx)
+
+    @property
+    def txn(self):
+        if self._pid != os.getpid():
+            self._open()
+        return self._txn
+
+    def _open(self):
+        if self._env is not None:
+            # Inherited from the parent by fork. Release it before reopening, lmdb refuses to open
+            # the same path twice in one process.
+            self._env.close()
+        self._env = lmdb.open(
+            self.lmdb_path,
+            readonly=True,
+            lock=False,
+            readahead=False,
+            meminit=False,
+            max_readers=self.max_readers,
+        )
+        self._txn = self._env.begin(write=False, buffers=True)
+        self._pid = os.getpid()
+
+    def close(self):
+        if self._pid == os.getpid() and self._env is not None:
+            self._txn.abort()
+            self._env.close()
+        self._pid = None
+        self._env = None
+        self._txn = None
+
+    def get(self, key):
+        return self.txn.get(key)
+
+    def getmulti(self, keys):
+        """Fetch several keys with one cursor. Keys are visited in sorted order to keep page reads local."""
+        order = sorted(range(len(keys)), key=lambda i: keys[i])
+        with self.txn.cursor() as cursor:
+            fetched = {bytes(key): value for key, value in cursor.getmulti([keys[i] for i in order])}
+        return [fetched.get(key) for key in keys]
+
+    def get_num_data(self):
+        if self._num_data is None:
+            self._num_data = int(bytes(self.get(encode("num_data"))))
+        return self._num_data
+
+    def get_img_buffer(self, idx, copy=True):
+        """Encoded image bytes as an uint8 array. `copy=False`: view of the memory map, see the class docstring."""
+        return to_array(self.get(encode(get_variant_key(idx, "img", self.width))), copy)
+
+    def get_img(self, idx, reduce_factor=None):
+        return decode_img(
+            self.get(encode(get_variant_key(idx, "img", self.width))), reduce_factor or self.reduce_factor
+        )
+
+    def get_annots(self, idx):
+        return json.loads(bytes(self.get(encode(get_variant_key(idx, "annots", self.width)))))
+
+    def get_sample(self, idx):
+        return self.getmulti_samples([idx])[0]
+
+    def getmulti_samples(self, indices, decode=True, copy=True):
+        """Batched fetch of img + annots for several indices.
+
+        Returns list of {"idx", "img", "annots", "reduce_factor"}. Annotation coordinates are always in
+        full resolution, divide them by `reduce_factor` when the image is decoded at reduced resolution.
+        If `decode` is False, "img" is the encoded image buffer. (`copy`: see `get_img_buffer`)
+        """
+        keys = []
+        for idx in indices:
+            keys.append(encode(get_variant_key(idx, "img", self.width)))
+            keys.append(encode(get_variant_key(idx, "annots", self.width)))
+        values = self.getmulti(keys)
+
+        samples = []
+        for i, idx in enumerate(indices):
+            img_buffer, annots = values[2 * i], values[2 * i + 1]
+            if img_buffer is None or annots is None:
+                raise KeyError(f"{idx} is not in {self.lmdb_path}")
+
+            if decode:
+                img = decode_img(img_buffer, self.reduce_factor)
+            else:
+                img = to_array(img_buffer, copy)
+            samples.append(
+                {
+                    "idx": idx,
+                    "img": img,
+                    "annots": json.loads(bytes(annots)),
+                    "reduce_factor": self.reduce_factor if decode else 1,
+                }
+            )
+        return samples
+
+
+def to_array(buffer, copy=True):
+    array = np.frombuffer(buffer, dtype=np.uint8)
+    return array.copy() if copy else array
+
+
+def decode_img(buffer, reduce_factor=1):
+    buffer = np.frombuffer(buffer, dtype=np.uint8)
+    return cv2.imdecode(buffer, REDUCED_DECODE_FLAGS[reduce_factor])
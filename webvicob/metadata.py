@@ -0,0 +1,239 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import json
+import struct
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from webvicob.image_codec import detect_codec
+
+METADATA_DIR = "metadata"
+SCHEMA_FILE = "schema.json"
+FONTS_FILE = "fonts.json"  # font id -> font file name
+FONT_IDS_FILE = "font_ids.npy"  # font ids of every row, concatenated. A row has `num_fonts` of them.
+NPY_HEADER_SIZE = 128  # fixed, rewritten in place as the columns grow
+
+# column name -> numpy dtype. One row per sample, `idx` is the sample key of the lmdb.
+METADATA_SCHEMA = {
+    "idx": "int64",
+    "article_id": "int64",
+    "lang": "U8",
+    "capture_width": "int32",
+    "page_width": "int32",
+    "page_height": "int32",
+    "num_chars": "int32",
+    "num_words": "int32",
+    "num_latex": "int32",
+    "num_lines": "int32",
+    "num_paragraphs": "int32",
+    "num_tables": "int32",
+    "num_images": "int32",
+    "num_fonts": "int32",  # -1 if unknown
+}
+
+
+def make_sample_meta(annots, img_buffer, lang, font2path=None, article_id=-1):
+    """One metadata row. "fonts": sorted font file names used by the page, None if unknown."""
+    page_width, page_height = get_image_size(img_buffer)
+    fonts = None if font2path is None else sorted({Path(path).name for path in font2path.values()})
+    num_chars = num_words = num_latex = 0
+    for line in annots["lines"]:
+        for word in line["words"]:
+            if word["is_latex"]:
+                num_latex += 1
+            else:
+                num_words += 1
+                num_chars += len(word["chars"])
+
+    return {
+        "article_id": article_id,
+        "lang": lang,
+        "capture_width": annots.get("capture_width", -1),
+        "page_width": page_width,
+        "page_height": page_height,
+        "num_chars": num_chars,
+        "num_words": num_words,
+        "num_latex": num_latex,
+        "num_lines": len(annots["lines"]),
+        "num_paragraphs": len(annots["paragraphs"]),
+        "num_tables": len(annots["tables"]),
+        "num_images": len(annots["images"]),
+        "num_fonts": -1 if font2path is None else len(fonts),
+        "fonts": fonts,
+    }
+
+
+def get_image_size(img_buffer):
+    """(width, height) of an encoded image, read from the jpeg / png / webp header when possible."""
+    img_buffer = bytes(img_buffer)
+    codec = detect_codec(img_buffer)
+    if codec == "png":
+        return struct.unpack(">II", img_buffer[16:24])
+    if codec == "webp":
+        chunk = img_buffer[12:16]
+        if chunk == b"VP8 ":
+            width, height = struct.unpack("<HH", img_buffer[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L":
+            bits = int.from_bytes(img_buffer[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return int.from_bytes(img_buffer[24:27], "little") + 1, int.from_bytes(img_buffer[27:30], "little") + 1
+    if codec == "jpeg":
+        offset = 2
+        while offset + 9 < len(img_buffer):
+            marker, length = struct.unpack(">HH", img_buffer[offset : offset + 4])
+            # SOF0 ~ SOF15, except DHT(C4), JPG(C8) and DAC(CC)
+            if 0xFFC0 <= marker <= 0xFFCF and marker not in (0xFFC4, 0xFFC8, 0xFFCC):
+                height, width = struct.unpack(">HH", img_buffer[offset + 5 : offset + 9])
+                return width, height
+            offset += 2 + length
+
+    img = cv2.imdecode(np.frombuffer(img_buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return img.shape[1], img.shape[0]
+
+
+class SampleMetadataWriter:
+    """Streams rows to `metadata/*.npy`. Every `chunk_size` rows are appended to the column files and the headers
+    and schema are rewritten, so memory stays bounded and an interrupted build keeps the rows flushed so far."""
+
+    def __init__(self, lmdb_path, chunk_size=1024, metadata_dir=METADATA_DIR):
+        self.path = Path(lmdb_path) / metadata_dir
+        self.chunk_size = chunk_size
+        self.columns = {name: [] for name in METADATA_SCHEMA}
+        self.font_ids = []
+        self.fonts = {}  # font file name -> font id
+        self.files = None
+        self.num_rows = 0
+        self.num_font_ids = 0
+
+    def append(self, idx, meta):
+        fonts = meta.get("fonts")
+        # rows of tables written without font ids keep no font count, a row has exactly `num_fonts` font ids.
+        meta = dict(meta, idx=idx, num_fonts=-1 if fonts is None else len(fonts))
+        for name, values in self.columns.items():
+            values.append(meta[name])
+        for font in fonts or []:
+            self.font_ids.append(self.fonts.setdefault(font, len(self.fonts)))
+        if len(self.columns["idx"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.files is None:
+            # created on the first flush, files of a previous table are truncated.
+            self.path.mkdir(parents=True, exist_ok=True)
+            self.files = {name: open(self.path / f"{name}.npy", "wb+") for name in METADATA_SCHEMA}
+            self.files[FONT_IDS_FILE] = open(self.path / FONT_IDS_FILE, "wb+")
+
+        num_rows = self.num_rows + len(self.columns["idx"])
+        for name, dtype in METADATA_SCHEMA.items():
+            append_npy(self.files[name], np.array(self.columns[name], dtype=dtype), num_rows)
+            self.columns[name] = []
+        num_font_ids = self.num_font_ids + len(self.font_ids)
+        append_npy(self.files[FONT_IDS_FILE], np.array(self.font_ids, dtype="int32"), num_font_ids)
+        self.num_rows, self.num_font_ids, self.font_ids = num_rows, num_font_ids, []
+
+        (self.path / FONTS_FILE).write_text(json.dumps(list(self.fonts), ensure_ascii=False))
+        schema = {"num_rows": self.num_rows, "columns": METADATA_SCHEMA}
+        (self.path / SCHEMA_FILE).write_text(json.dumps(schema, indent=1))
+
+    def save(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = None
+
+
+def append_npy(f, values, length):
+    """Append `values` to the 1-d .npy file `f` and rewrite its header for `length` values."""
+    f.seek(0, 2)
+    if f.tell() == 0:
+        f.write(bytes(NPY_HEADER_SIZE))
+    f.write(values.tobytes())
+    header = {"descr": np.lib.format.dtype_to_descr(values.dtype), "fortran_order": False, "shape": (length,)}
+    header = repr(header).ljust(NPY_HEADER_SIZE - 11) + "\n"
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+    f.flush()
+
+
+class SampleMetadata:
+    """Columnar per-sample metadata of a WebvicobLMDB split, for vectorized filtering without reading the lmdb.
+
+    >>> meta = SampleMetadata("workspace/en_2023_05_03_FULL/train")
+    >>> keys = meta.select(lang="en", page_height=(None, 4096), num_chars=(500, None), capture_width=[800, 1200])
+    """
+
+    def __init__(self, lmdb_path):
+        self.path = Path(lmdb_path) / METADATA_DIR
+        self.schema = json.loads((self.path / SCHEMA_FILE).read_text())
+        self._columns = {}
+        self._fonts = self._font_ids = self._font_offsets = None
+
+    def __len__(self):
+        return self.schema["num_rows"]
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.load(self.path / f"{name}.npy", mmap_mode="r")
+        return self._columns[name]
+
+    def row(self, i):
+        row = {name: self[name][i].item() for name in self.schema["columns"]}
+        row["fonts"] = self.get_fonts(i)
+        return row
+
+    def load_fonts(self):
+        """font id -> font file name, font ids of every row and row offsets into them."""
+        if self._fonts is None:
+            self._fonts = json.loads((self.path / FONTS_FILE).read_text())
+            self._font_ids = np.zeros(0, dtype="int32")
+            if (self.path / FONT_IDS_FILE).stat().st_size > NPY_HEADER_SIZE:
+                self._font_ids = np.load(self.path / FONT_IDS_FILE, mmap_mode="r")
+            self._font_offsets = np.concatenate([[0], np.cumsum(np.maximum(self["num_fonts"], 0))])
+        return self._fonts, self._font_ids, self._font_offsets
+
+    def get_fonts(self, i):
+        """Font file names used by row `i`, None if unknown."""
+        if self["num_fonts"][i] < 0 or not (self.path / FONTS_FILE).exists():  # tables without font ids
+            return None
+        fonts, font_ids, offsets = self.load_fonts()
+        return [fonts[font_id] for font_id in font_ids[offsets[i] : offsets[i + 1]]]
+
+    def font_mask(self, fonts):
+        """Boolean mask of rows using any of the font file names `fonts`."""
+        all_fonts, font_ids, offsets = self.load_fonts()
+        uses_font = np.isin(font_ids, [font_id for font_id, font in enumerate(all_fonts) if font in set(fonts)])
+        rows = np.repeat(np.arange(len(self)), np.diff(offsets))
+        mask = np.zeros(len(self), dtype=bool)
+        mask[rows[uses_font]] = True
+        return mask
+
+    def mask(self, **conditions):
+        """Boolean mask of rows matching every condition.
+
+        value ==> equal, (low, high) ==> low <= column <= high (None is unbounded), list/set ==> one of values.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            column = self[name]
+            if isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    mask &= column >= low
+                if high is not None:
+                    mask &= column <= high
+            elif isinstance(condition, (list, set, frozenset)):
+                mask &= np.isin(column, list(condition))
+            else:
+                mask &= column == condition
+        return mask
+
+    def select(self, **conditions):
+        """Sample keys (`idx`) of rows matching every condition. See `mask()`."""
+        return np.asarray(self["idx"][self.mask(**conditions)])
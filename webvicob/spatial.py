@@ -0,0 +1,184 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import io
+import json
+
+import numpy as np
+
+SPATIAL_KINDS = ("word", "image", "table", "paragraph")
+
+# One entry per word / image / table / paragraph, sorted by top. `start`, `end` locate the json of the entry in the
+# stored annots. `max_bottom` is the running max of the bottoms, so both ends of a window scan are binary searched.
+SPATIAL_INDEX_DTYPE = np.dtype(
+    [("bbox", "<f4", (4,)), ("max_bottom", "<f4"), ("kind", "<i1"), ("line", "<i4"), ("start", "<i8"), ("end", "<i8")]
+)
+
+
+def build_spatial_index(annots):
+    """(index, annots json). The json is the utf-8 of `json.dumps(annots, ensure_ascii=False)`, stored as the annots
+    of the sample, and the entries of the index point into it."""
+    entries = []
+    annots_json = AnnotsJsonWriter()
+    annots_json.write("{")
+    for key_no, (key, value) in enumerate(annots.items()):
+        annots_json.write(f"{', ' if key_no > 0 else ''}{json.dumps(key)}: ")
+        if key == "lines":
+            annots_json.write_list(value, lambda line_no, line: annots_json.write_line(line, line_no, entries))
+        elif key in ("images", "tables", "paragraphs"):
+            kind = key[:-1]
+            annots_json.write_list(value, lambda _, record: entries.append(annots_json.write_record(record, kind)))
+        else:
+            annots_json.write(json.dumps(value, ensure_ascii=False))
+    annots_json.write("}")
+    entries.sort(key=lambda entry: entry[0][1])
+
+    index = np.zeros(len(entries), dtype=SPATIAL_INDEX_DTYPE)
+    for i, (bbox, kind, line_no, start, end) in enumerate(entries):
+        index[i] = (bbox, 0, SPATIAL_KINDS.index(kind), line_no, start, end)
+    index["max_bottom"] = np.maximum.accumulate(index["bbox"][:, 3])
+    return index, annots_json.getvalue()
+
+
+class AnnotsJsonWriter:
+    """Writes json as `json.dumps(..., ensure_ascii=False)` does, and records the byte range of the indexed entries."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, text):
+        self.buffer.write(text.encode("utf-8"))
+
+    def write_list(self, values, write_value):
+        self.write("[")
+        for value_no, value in enumerate(values):
+            if value_no > 0:
+                self.write(", ")
+            write_value(value_no, value)
+        self.write("]")
+
+    def write_line(self, line, line_no, entries):
+        self.write("{")
+        for key_no, (key, value) in enumerate(line.items()):
+            self.write(f"{', ' if key_no > 0 else ''}{json.dumps(key)}: ")
+            if key == "words":
+                self.write_list(value, lambda _, word: entries.append(self.write_record(word, "word", line_no)))
+            else:
+                self.write(json.dumps(value, ensure_ascii=False))
+        self.write("}")
+
+    def write_record(self, record, kind, line_no=-1):
+        """(bbox, kind, line_no, start, end) entry of the record."""
+        start = self.buffer.tell()
+        self.write(json.dumps(record, ensure_ascii=False))
+        if kind == "paragraph":
+            xs, ys = record["poly"][0::2], record["poly"][1::2]
+            bbox = [min(xs), min(ys), max(xs), max(ys)]
+        else:
+            bbox = record["bbox"]
+        return bbox, kind, line_no, start, self.buffer.tell()
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+def pack_spatial_index(index):
+    buffer = io.BytesIO()
+    np.save(buffer, index, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def unpack_spatial_index(buffer):
+    return np.load(io.BytesIO(buffer), allow_pickle=False)
+
+
+def query_spatial_index(index, x0, y0, x1, y1):
+    """Entries intersecting the window. Entries below the window (top >= y1) and above it (every bottom so far
+    <= y0) are cut by binary search, only the rows between them are tested."""
+    start = np.searchsorted(index["max_bottom"], y0, side="right")
+    end = np.searchsorted(index["bbox"][:, 1], y1, side="left")
+    entries = index[start:end]
+    bboxes = entries["bbox"]
+    return entries[(bboxes[:, 0] < x1) & (bboxes[:, 2] > x0) & (bboxes[:, 3] > y0)]
+
+
+def crop_annots(index, annots_json, x0, y0, x1, y1):
+    """Annotations inside the window, clipped to it and translated to crop coordinates.
+
+    Only the json of intersecting entries is parsed. Chars are kept if they intersect the window,
+    and the text of a cut word is made of its kept chars.
+    """
+    annots_json = memoryview(annots_json)
+    window = (x0, y0, x1, y1)
+    crop = {"paragraphs": [], "lines": [], "images": [], "tables": []}
+    lines = {}
+    for entry in query_spatial_index(index, x0, y0, x1, y1):
+        record = json.loads(bytes(annots_json[entry["start"] : entry["end"]]))
+        kind = SPATIAL_KINDS[entry["kind"]]
+        if kind == "word":
+            word = crop_word(record, window)
+            if word is not None:
+                lines.setdefault(int(entry["line"]), []).append(word)
+        elif kind == "paragraph":
+            crop["paragraphs"] += crop_poly(record["poly"], window)
+        else:
+            crop[f"{kind}s"].append({"bbox": clip_bbox(record["bbox"], window)})
+
+    for line_no in sorted(lines):
+        words = sorted(lines[line_no], key=lambda word: word["bbox"][0])
+        bboxes = np.array([word["bbox"] for word in words])
+        line_bbox = [*bboxes[:, :2].min(axis=0).tolist(), *bboxes[:, 2:].max(axis=0).tolist()]
+        crop["lines"].append({"words": words, "bbox": line_bbox})
+    return crop
+
+
+def crop_word(word, window):
+    if word["chars"] is None:  # latex
+        return {**word, "bbox": clip_bbox(word["bbox"], window)}
+
+    chars = [
+        {"bbox": clip_bbox(char["bbox"], window), "text": char["text"]}
+        for char in word["chars"]
+        if intersects(char["bbox"], window)
+    ]
+    if len(chars) == 0:
+        return None
+    bboxes = np.array([char["bbox"] for char in chars])
+    return {
+        "is_latex": False,
+        "chars": chars,
+        "text": "".join(char["text"] for char in chars),
+        "bbox": [*bboxes[:, :2].min(axis=0).tolist(), *bboxes[:, 2:].max(axis=0).tolist()],
+    }
+
+
+def crop_poly(poly, window):
+    from shapely.geometry import Polygon, box
+
+    x0, y0, x1, y1 = window
+    clipped = Polygon(list(zip(poly[0::2], poly[1::2]))).buffer(0).intersection(box(x0, y0, x1, y1))
+    paras = []
+    for geom in getattr(clipped, "geoms", [clipped]):
+        if not isinstance(geom, Polygon) or geom.is_empty:
+            continue
+        para_poly = []
+        for x, y in list(geom.exterior.coords)[:-1]:
+            para_poly += [x - x0, y - y0]
+        paras.append({"poly": para_poly})
+    return paras
+
+
+def intersects(bbox, window):
+    return bbox[0] < window[2] and bbox[2] > window[0] and bbox[1] < window[3] and bbox[3] > window[1]
+
+
+def clip_bbox(bbox, window):
+    x0, y0, x1, y1 = window
+    return [
+        min(max(bbox[0], x0), x1) - x0,
+        min(max(bbox[1], y0), y1) - y0,
+        min(max(bbox[2], x0), x1) - x0,
+        min(max(bbox[3], y0), y1) - y0,
+    ]
@@ -0,0 +1,73 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import multiprocessing as mp
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import fire
+
+from webvicob.wikipedia.wikipedia import FORKSERVER_PRELOAD
+
+IMPORT_SCRIPT = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+
+def worker_ready(start_time):
+    """Seconds from pool creation until the worker unpickled this task, i.e. imported the worker module."""
+    import webvicob.wikipedia.wikipedia  # noqa: F401
+
+    return os.getpid(), time.time() - start_time
+
+
+def measure_import(module="webvicob.wikipedia.wikipedia"):
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT.format(module=module)], env=os.environ)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def measure_workers(ctx, num_workers):
+    """(first ready, recycled ready) seconds. Each worker runs one task, the second batch runs on replacements."""
+    start_time = time.time()
+    pool = ctx.Pool(num_workers, maxtasksperchild=1)
+    try:
+        first = [pool.apply_async(worker_ready, (start_time,)) for _ in range(num_workers)]
+        first_ready = max(result.get()[1] for result in first)
+        start_time = time.time()
+        recycled = [pool.apply_async(worker_ready, (start_time,)) for _ in range(num_workers)]
+        recycled_ready = max(result.get()[1] for result in recycled)
+    finally:
+        pool.terminate()
+    return first_ready, recycled_ready
+
+
+def benchmark_startup(num_workers=4, start_methods=("spawn", "forkserver"), repeat=3):
+    """Import time of the worker module, and time until `num_workers` pool workers are ready per start method.
+
+    "first" is a new pool, "recycled" is the steady state of workers replaced by maxtasksperchild.
+    The forkserver (preloading FORKSERVER_PRELOAD) is started once, by the first pool.
+    """
+    import_seconds = [measure_import() for _ in range(repeat)]
+    print(f"import webvicob.wikipedia.wikipedia: {statistics.median(import_seconds) * 1e3:.0f} ms")
+
+    for start_method in start_methods:
+        if start_method not in mp.get_all_start_methods():
+            print(f"{start_method}: not available")
+            continue
+        ctx = mp.get_context(start_method)
+        if start_method == "forkserver":
+            ctx.set_forkserver_preload(FORKSERVER_PRELOAD)
+        timings = [measure_workers(ctx, num_workers) for _ in range(repeat)]
+        first_ready = statistics.median(first for first, _ in timings)
+        recycled_ready = statistics.median(recycled for _, recycled in timings)
+        print(
+            f"{start_method}: {num_workers} workers ready in {first_ready * 1e3:.0f} ms (first), "
+            f"{recycled_ready * 1e3:.0f} ms (recycled)"
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark_startup)
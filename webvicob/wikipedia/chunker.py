@@ -3,21 +3,35 @@ WEBVICOB
 Copyright 2022-present NAVER Corp.
 Apache-2.0
 """
+import math
 import re
+from html import escape
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Comment, Tag
 
 
 class WikiHtmlChunker:
     SECTION_START_PATTERN = '<section data-mw-section-id="[\-0-9]+" id="[\-a-zA-Z0-9]+">'
     SECTION_END_PATTERN = "</section>"
 
+    # Rough layout constants of wikipedia pages, used to estimate rendered height.
+    CHAR_WIDTH = 8
+    LINE_HEIGHT = 22
+    BLOCK_MARGIN = 12
+    TABLE_ROW_HEIGHT = 12  # cell paddings and borders, in addition to text lines
+    TITLE_HEIGHT = 60
+    BLOCK_TAGS = ["p", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dd", "blockquote", "figure", "tr"]
+    INVISIBLE_TAGS = ["style", "script", "link", "meta"]
+    ATOMIC_TAGS = ["table", "figure"]
+
     def __init__(
         self,
         min_section_tokens: int = 100,
         min_section_chars: int = None,
         append_title: bool = True,
         max_section_depth: int = 0,
+        max_render_height: int = None,
+        capture_width: int = 1200,
     ):
         # wikipedia chunk options
         self.min_section_tokens = min_section_tokens
@@ -25,6 +39,10 @@ class WikiHtmlChunker:
         self.append_title = append_title
         self.max_section_depth = max_section_depth
 
+        # upper bound of chunk size, in estimated rendered height (px) at capture_width
+        self.max_render_height = max_render_height
+        self.capture_width = capture_width
+
     def __call__(self, html: str):
         chunks = []
 
@@ -101,7 +119,102 @@ class WikiHtmlChunker:
                 continue
         return section_indexes
 
+    def estimate_render_height(self, tag):
+        """Rough rendered height (px) of a tag at `capture_width`."""
+        if tag.name in self.INVISIBLE_TAGS:
+            return 0
+
+        num_chars = sum(
+            len(string)
+            for string in tag.find_all(string=True)
+            if not isinstance(string, Comment) and string.parent.name not in self.INVISIBLE_TAGS
+        )
+        height = math.ceil(num_chars * self.CHAR_WIDTH / self.capture_width) * self.LINE_HEIGHT
+
+        # every block element adds margins and at least one partially filled line.
+        num_blocks = len(tag.find_all(self.BLOCK_TAGS)) + int(tag.name in self.BLOCK_TAGS)
+        height += num_blocks * (self.BLOCK_MARGIN + self.LINE_HEIGHT)
+        height += len(tag.find_all("tr")) * self.TABLE_ROW_HEIGHT
+
+        imgs = [tag] if tag.name == "img" else tag.find_all("img")
+        for img in imgs:
+            try:
+                width, img_height = int(img.get("width", 0)), int(img.get("height", 0))
+            except ValueError:
+                continue
+            if width > self.capture_width:
+                img_height = img_height * self.capture_width / width
+            height += img_height
+        return height
+
+    def split_oversized_sections(self, sections):
+        outputs = []
+        for section in sections:
+            outputs += self.split_oversized_tag(section)
+        return outputs
+
+    def split_oversized_tag(self, tag):
+        """Split a tag taller than `max_render_height` at paragraph or table boundaries.
+
+        Children are distributed to consecutive copies of the tag. Oversized children (nested sections, reference
+        lists, ...) are split recursively, except tables and figures which are kept whole.
+        """
+        if tag.name in self.ATOMIC_TAGS or self.estimate_render_height(tag) <= self.max_render_height:
+            return [tag]
+
+        children = []
+        for child in tag.children:
+            if isinstance(child, Tag):
+                children += self.split_oversized_tag(child)
+            else:
+                children.append(child)
+
+        parts = []
+        part = []
+        part_height = 0
+        for child in children:
+            child_height = self.estimate_render_height(child) if isinstance(child, Tag) else 0
+            if len(part) > 0 and child_height > 0 and part_height + child_height > self.max_render_height:
+                parts.append(part)
+                part = []
+                part_height = 0
+            part.append(child)
+            part_height += child_height
+        if len(part) > 0:
+            parts.append(part)
+        if len(parts) < 2:
+            return [tag]
+
+        outputs = []
+        for part_idx, part in enumerate(parts):
+            attrs = dict(tag.attrs)
+            if part_idx > 0 and "id" in attrs:
+                attrs["id"] = f"{attrs['id']}_{part_idx}"
+            attrs = "".join(f' {k}="{escape(" ".join(v) if isinstance(v, list) else v)}"' for k, v in attrs.items())
+            body = "".join(str(child) for child in part)
+            outputs.append(BeautifulSoup(f"<{tag.name}{attrs}>{body}</{tag.name}>", "html.parser").find(tag.name))
+        return outputs
+
+    def split_groups_by_height(self, groups):
+        outputs = []
+        for group in groups:
+            sub_group = []
+            cur_height = self.TITLE_HEIGHT
+            for section in group:
+                height = self.estimate_render_height(section)
+                if len(sub_group) > 0 and cur_height + height > self.max_render_height:
+                    outputs.append(sub_group)
+                    sub_group = []
+                    cur_height = self.TITLE_HEIGHT
+                sub_group.append(section)
+                cur_height += height
+            outputs.append(sub_group)
+        return outputs
+
     def merge_into_chunks(self, sections, html_front, html_back):
+        if self.max_render_height is not None:
+            sections = self.split_oversized_sections(sections)
+
         groups = []
         if self.min_section_tokens is None and self.min_section_chars is None:
             groups = [[section] for section in sections]
@@ -186,6 +299,9 @@ class WikiHtmlChunker:
                 else:
                     continue
 
+        if self.max_render_height is not None:
+            groups = self.split_groups_by_height(groups)
+
         chunks = []
         for group in groups:
             body = ""
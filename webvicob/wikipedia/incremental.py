@@ -0,0 +1,182 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import json
+from pathlib import Path
+
+from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.metadata import METADATA_DIR, SampleMetadata, make_sample_meta
+
+FINGERPRINT_FILE = "fingerprints.json"
+CHANGELOG_FILE = "changelog.json"
+
+# options of `main` which change the samples of an article. Samples of another build are reused only if all match.
+FINGERPRINT_OPTIONS = (
+    "capture_widths",
+    "capture_height_limit",
+    "final_width",
+    "multi_width_capture",
+    "bake_styles",
+    "remove_background",
+    "unroll_contents",
+    "change_para_font",
+    "char_boxes",
+    "shrink_heuristic",
+    "para_poly_engine",
+    "image_codec",
+)
+
+
+def get_build_options(opt):
+    return json.loads(json.dumps({name: opt.get(name) for name in FINGERPRINT_OPTIONS}))
+
+
+class FingerprintIndex:
+    """article identifier -> revision and the samples rendered from the article, saved next to each build.
+
+    Only complete articles are saved: every submitted chunk (`num_chunks`, quarantined chunks are not submitted) was
+    rendered and all of its samples were written. Articles with failed, timed out or rejected chunks, or cut by
+    `num_train`, are rendered again by the next build.
+    """
+
+    def __init__(self, options=None):
+        self.options = options
+        self.articles = {}
+
+    def add(self, result, mode, idx):
+        article_id = str(result["article_id"])
+        if article_id not in self.articles:
+            self.articles[article_id] = {
+                "revision": result["revision"],
+                "samples": [],
+                "num_chunks": result["num_chunks"],
+                "done": set(),
+            }
+        self.articles[article_id]["samples"].append([mode, idx])
+
+    def done(self, result):
+        """Every sample of the chunk `result` was written."""
+        self.articles[str(result["article_id"])]["done"].add(result["chunk_no"])
+
+    def save(self, build_dir: Path):
+        articles = {
+            article_id: {"revision": article["revision"], "samples": article["samples"]}
+            for article_id, article in self.articles.items()
+            if len(article["done"]) == article["num_chunks"]
+        }
+        (build_dir / FINGERPRINT_FILE).write_text(json.dumps({"options": self.options, "articles": articles}))
+
+
+class IncrementalBuild:
+    """Re-render only new or changed articles of a dump, unchanged articles are copied from a previous build.
+
+    `is_unchanged()` is checked by the html generator before an article is parsed and chunked, unchanged articles
+    are yielded as one "unchanged" input. `filter()` replaces it with the previous samples of the article, as
+    "copied" inputs which are passed through to the results without rendering, and keep the split (train/val/test)
+    of the previous build. Nothing is copied if the previous build was made with other build options.
+    """
+
+    def __init__(self, previous_build: Path, options=None):
+        self.previous_build = Path(previous_build)
+        fingerprint_path = self.previous_build / FINGERPRINT_FILE
+        assert fingerprint_path.exists(), f"{fingerprint_path} does not exist. Build it without incremental mode."
+        fingerprints = json.loads(fingerprint_path.read_text())
+        if "articles" not in fingerprints:  # fingerprints saved without build options
+            fingerprints = {"options": None, "articles": fingerprints}
+        self.previous = fingerprints["articles"]
+        self.reusable = fingerprints["options"] == options
+        if not self.reusable:
+            previous_options = fingerprints["options"] or {}
+            changed = {
+                k: (previous_options.get(k), v) for k, v in (options or {}).items() if previous_options.get(k) != v
+            }
+            print(f"every article is rendered again, build options differ from {self.previous_build}: {changed}")
+        self.previous_lmdbs = {
+            mode: WebvicobLMDB(self.previous_build / mode, readonly=True, verbose=False)
+            for mode in ("train", "val", "test")
+        }
+        self.previous_metadata = {
+            mode: SampleMetadata(self.previous_build / mode)
+            for mode in self.previous_lmdbs
+            if (self.previous_build / mode / METADATA_DIR).exists()
+        }
+
+        self.changelog = {"added": [], "changed": [], "unchanged": [], "removed": []}
+        self.exhausted = False
+        self._seen = set()
+        self._copied = {}  # (mode, previous idx) -> idx, of the article being copied
+        self._copied_article = None
+
+    def is_unchanged(self, article_id, revision):
+        previous = self.previous.get(str(article_id))
+        return self.reusable and previous is not None and previous["revision"] == revision
+
+    def filter(self, inputs):
+        for inp in inputs:
+            article_id = str(inp["article_id"])
+            if article_id not in self._seen:
+                self._seen.add(article_id)
+                if article_id not in self.previous:
+                    self.changelog["added"].append(article_id)
+                elif inp.get("status") != "unchanged":
+                    self.changelog["changed"].append(article_id)
+                else:
+                    self.changelog["unchanged"].append(article_id)
+
+            if inp.get("status") != "unchanged":
+                yield inp
+                continue
+            samples = self.previous[article_id]["samples"]
+            for sample_no, (src_mode, src_idx) in enumerate(samples):
+                yield {
+                    "status": "copied",
+                    "key": f"{article_id}_copy",
+                    "article_id": article_id,
+                    "revision": inp["revision"],
+                    "mode": src_mode,
+                    "src_idx": src_idx,
+                    "chunk_no": sample_no,
+                    "num_chunks": len(samples),
+                }
+        self.exhausted = True
+
+    def copy_sample(self, result, webvicob_lmdb, idx):
+        """Copy a previous sample. Samples sharing the html of one page load share the copied html too."""
+        if result["article_id"] != self._copied_article:
+            self._copied, self._copied_article = {}, result["article_id"]
+        mode, src_idx = result["mode"], result["src_idx"]
+        src = self.previous_lmdbs[mode]
+        html_idx = self._copied.get((mode, src.get_html_idx(src_idx)))
+        webvicob_lmdb.copy_sample(src, src_idx, idx, html_idx)
+        self._copied[(mode, src_idx)] = idx
+
+    def get_sample_meta(self, result, webvicob_lmdb, idx, lang):
+        previous_metadata = self.previous_metadata.get(result["mode"])
+        if previous_metadata is not None:
+            return previous_metadata.row(result["src_idx"])
+        # previous build without metadata, fonts of the sample are unknown.
+        return make_sample_meta(
+            webvicob_lmdb.get_annots(idx),
+            webvicob_lmdb.get(f"{idx}_img".encode()),
+            lang,
+            article_id=int(result["article_id"]),
+        )
+
+    def save_changelog(self, build_dir: Path):
+        if self.exhausted:
+            # Removed articles are known only when the whole dump was visited.
+            self.changelog["removed"] = sorted(set(self.previous) - self._seen)
+        changelog = {"previous_build": str(self.previous_build.resolve()), "complete": self.exhausted}
+        changelog.update(self.changelog)
+        (build_dir / CHANGELOG_FILE).write_text(json.dumps(changelog, indent=1))
+        print(
+            "incremental build: "
+            + ", ".join(f"{k} {len(v)}" for k, v in self.changelog.items())
+            + f" articles (previous: {self.previous_build})"
+        )
+
+    def close(self):
+        for previous_lmdb in self.previous_lmdbs.values():
+            previous_lmdb.env.close()
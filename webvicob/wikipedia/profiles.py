@@ -0,0 +1,79 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import os
+import re
+import shutil
+import tempfile
+from multiprocessing import util
+from pathlib import Path
+from uuid import uuid4
+
+import psutil
+
+PROFILE_PREFIX = "webvicob_profile_"
+PROFILE_PATTERN = re.compile(rf"{PROFILE_PREFIX}(\d+)_[0-9a-f]+")
+DISK_CACHE_SIZE = 64 * 1024**2  # pages are loaded once, the cache is rarely hit
+
+_profile = None
+
+
+class BrowserProfile:
+    """Chrome user-data, data and disk-cache directories of one worker process.
+
+    Reused by every driver the worker starts, and removed when the worker exits. Directories of crashed
+    workers are removed by `cleanup_orphan_profiles`. Use a RAM-backed `root` (e.g. /dev/shm) to avoid disk I/O.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root or tempfile.gettempdir())
+        self.path = self.root / f"{PROFILE_PREFIX}{os.getpid()}_{uuid4().hex[:8]}"
+        self.user_data_dir = self.path / "user_data"
+        self.data_path = self.path / "data"
+        self.disk_cache_dir = self.path / "cache"
+        for path in (self.user_data_dir, self.data_path, self.disk_cache_dir):
+            path.mkdir(parents=True, exist_ok=True)
+        # Pool workers leave through os._exit, only multiprocessing finalizers run there.
+        util.Finalize(self, shutil.rmtree, args=(self.path, True), exitpriority=10)
+
+    def prepare(self):
+        """Remove the profile lock of a previous chrome of this worker, it may have been killed."""
+        for lock in self.user_data_dir.glob("Singleton*"):
+            lock.unlink(missing_ok=True)
+
+    def disk_usage(self):
+        return get_disk_usage(self.path)
+
+
+def get_browser_profile(root=None):
+    global _profile
+    if _profile is None or _profile.path.parent != Path(root or tempfile.gettempdir()):
+        _profile = BrowserProfile(root)
+    return _profile
+
+
+def get_disk_usage(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def cleanup_orphan_profiles(root=None):
+    """Remove profile directories whose worker process is gone. Returns (number of profiles, bytes) removed."""
+    root = Path(root or tempfile.gettempdir())
+    num_removed, num_bytes = 0, 0
+    for path in root.glob(f"{PROFILE_PREFIX}*"):
+        match = PROFILE_PATTERN.fullmatch(path.name)
+        if match is None or psutil.pid_exists(int(match.group(1))):
+            continue
+        num_bytes += get_disk_usage(path)
+        shutil.rmtree(path, ignore_errors=True)
+        num_removed += 1
+    return num_removed, num_bytes
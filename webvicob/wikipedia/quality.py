@@ -0,0 +1,55 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+DEFAULT_QUALITY_GATES = {
+    "min_chars": None,  # non-space char boxes
+    "min_text_coverage": None,  # char box area / page area
+    "max_image_ratio": None,  # image box area / page area
+}
+
+
+def get_quality_gates(gates=None):
+    quality_gates = dict(DEFAULT_QUALITY_GATES)
+    if gates is not None:
+        unknown = set(gates) - set(quality_gates)
+        assert len(unknown) == 0, f"unknown quality gates {unknown}. available gates: {list(quality_gates)}"
+        quality_gates.update(gates)
+    return quality_gates
+
+
+def get_box_stats(boxes, page_width, page_height):
+    """Cheap statistics of `get_boxes` output on the captured page of `page_width` x `page_height` pixels."""
+    num_chars, char_area, image_area = 0, 0.0, 0.0
+    for box in boxes:
+        x0, y0, x1, y1 = box["bbox"]
+        area = max(x1 - x0, 0) * max(y1 - y0, 0)
+        if box["box_type"] == "char":
+            if not box["text"].isspace():
+                num_chars += 1
+                char_area += area
+        elif box["box_type"] == "image":
+            image_area += area
+
+    page_area = max(page_width * page_height, 1.0)
+    return {
+        "num_chars": num_chars,
+        "text_coverage": char_area / page_area,
+        "image_ratio": min(image_area / page_area, 1.0),  # overlapping images are counted twice
+    }
+
+
+def check_quality(boxes, gates, page_width, page_height):
+    """Name of the first failed gate, None if the page passes every gate. Gates set to None are skipped."""
+    if all(value is None for value in gates.values()):
+        return None
+
+    stats = get_box_stats(boxes, page_width, page_height)
+    if gates["min_chars"] is not None and stats["num_chars"] < gates["min_chars"]:
+        return "min_chars"
+    if gates["min_text_coverage"] is not None and stats["text_coverage"] < gates["min_text_coverage"]:
+        return "min_text_coverage"
+    if gates["max_image_ratio"] is not None and stats["image_ratio"] > gates["max_image_ratio"]:
+        return "max_image_ratio"
+    return None
@@ -0,0 +1,135 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import multiprocessing as mp
+import os
+import shutil
+import time
+import traceback
+from pathlib import Path
+
+import fire
+
+from webvicob.image_codec import get_image_codec
+from webvicob.lmdb_maker import WebvicobLMDB, encode
+from webvicob.metadata import (
+    METADATA_DIR,
+    SampleMetadata,
+    SampleMetadataWriter,
+    make_sample_meta,
+)
+from webvicob.wikipedia.wikipedia import annotate
+
+webvicob_lmdb = None
+opt = None
+
+
+def reannotate(
+    lmdb_path,
+    shrink_heuristic=True,
+    final_width=None,
+    para_poly_engine="shapely",
+    num_process=-1,
+    image_codec="jpeg",
+    image_quality=95,
+    jpeg_subsampling=None,
+):
+    """Rebuild the annots (and img) of a split in place from the box records saved with `save_box_records=True`.
+
+    Runs `annotate` of the wikipedia pipeline on the recorded `get_boxes` output and captured jpeg,
+    so annotation options can be tuned without rendering pages again. Samples without a box record are kept.
+    """
+    if num_process == -1:
+        num_process = os.cpu_count()
+    lmdb_path = Path(lmdb_path)
+    writer = WebvicobLMDB(lmdb_path, verbose=False)
+    num_data = writer.get_num_data()
+
+    previous_metadata = None
+    if (lmdb_path / METADATA_DIR).exists():
+        previous_metadata = SampleMetadata(lmdb_path)  # rows are read from the memmapped columns per sample
+
+    job_opt = {
+        "shrink_heuristic": shrink_heuristic,
+        "final_width": final_width,
+        "para_poly_engine": para_poly_engine,
+        "image_codec": get_image_codec(image_codec, image_quality, jpeg_subsampling),  # of resized images
+    }
+    # the previous table is read while the new one is written, it is swapped in at the end.
+    new_metadata_dir = f"{METADATA_DIR}.tmp"
+    metadata_writer = SampleMetadataWriter(lmdb_path, metadata_dir=new_metadata_dir)
+    counter = {"reannotated": 0, "no record": 0, "failed": 0}
+    start_time = time.time()
+    with mp.get_context("spawn").Pool(num_process, initializer=init_worker, initargs=(str(lmdb_path), job_opt)) as pool:
+        for result in pool.imap(reannotate_job, range(num_data), chunksize=16):
+            idx = result["idx"]
+            counter[result["status"]] += 1
+            if result["status"] == "reannotated":
+                if result["capture"] is not None:
+                    # keep the original capture before the img is overwritten by the resized one.
+                    writer.put(encode(f"{idx}_capture"), result["capture"])
+                writer.put_img(result["jpeg"], idx)
+                writer.put_annots(result["annots"], idx)
+                for width, jpeg, annots in result["variants"]:
+                    writer.put_img(jpeg, idx, width)
+                    writer.put_annots(annots, idx, width)
+                # variants of a previous final_width
+                for width in set(writer.get_variant_widths(idx)) - {width for width, _, _ in result["variants"]}:
+                    writer.delete_variant(idx, width)
+
+            if previous_metadata is not None:
+                meta = previous_metadata.row(idx)
+                if result["status"] == "reannotated":
+                    meta = make_sample_meta(
+                        result["annots"], result["jpeg"], meta["lang"], result["font2path"], meta["article_id"]
+                    )
+                metadata_writer.append(idx, meta)
+
+            if (idx + 1) % 1000 == 0:
+                print(f"[{idx + 1} / {num_data}] {counter}", flush=True)
+
+    if previous_metadata is not None:
+        metadata_writer.save()
+        del previous_metadata
+        shutil.rmtree(lmdb_path / METADATA_DIR)
+        os.replace(lmdb_path / new_metadata_dir, lmdb_path / METADATA_DIR)
+    writer.wrap_up()
+    print(f"{lmdb_path}: {counter} in {time.time() - start_time:.1f}s")
+
+
+def init_worker(lmdb_path, job_opt):
+    global webvicob_lmdb, opt
+    webvicob_lmdb = WebvicobLMDB(Path(lmdb_path), readonly=True, verbose=False)
+    opt = job_opt
+
+
+def reannotate_job(idx):
+    result = {"idx": idx, "status": "failed"}
+    try:
+        box_record, capture = webvicob_lmdb.get_box_record(idx)
+        if box_record is None:
+            result["status"] = "no record"
+            return result
+
+        has_capture = webvicob_lmdb.get(encode(f"{idx}_capture")) is not None
+        variants = annotate(
+            capture, box_record["boxes"], box_record["font2path"], box_record["capture_width"], box_record["lang"], opt
+        )
+        _, jpeg, annots = variants[0]
+        result.update(
+            status="reannotated",
+            jpeg=jpeg,
+            annots=annots,
+            variants=variants[1:],
+            font2path=box_record["font2path"],
+            capture=capture if opt["final_width"] is not None and not has_capture else None,
+        )
+    except:
+        print(traceback.format_exc(), flush=True)
+    return result
+
+
+if __name__ == "__main__":
+    fire.Fire(reannotate)
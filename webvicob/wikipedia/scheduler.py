@@ -0,0 +1,473 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import contextlib
+import heapq
+import os
+import queue
+import shutil
+import tempfile
+import time
+from collections import deque
+from functools import partial
+from multiprocessing import util
+
+import psutil
+
+MiB = 1024**2
+GiB = 1024**3
+
+# Rough memory cost of one render. chrome itself + span-wrapped DOM (about one element per html byte).
+RENDER_BASE_MEMORY = 300 * MiB
+RENDER_MEMORY_PER_HTML_BYTE = 512
+
+# Memory of a freshly admitted render is not visible in `available` until chrome has loaded the page.
+ADMISSION_RAMP_SECONDS = 10
+
+
+# Render time grows with html size, and every section adds layout work (paragraphs, tables, figures).
+RENDER_COST_PER_SECTION = 2000  # in html bytes
+
+
+def is_copied(inp):
+    """Samples copied from a previous build (incremental builds) are passed through without rendering."""
+    return inp.get("status") == "copied"
+
+
+def estimate_render_memory(inp):
+    return RENDER_BASE_MEMORY + RENDER_MEMORY_PER_HTML_BYTE * len(inp["html"])
+
+
+def estimate_render_cost(inp):
+    if is_copied(inp):  # no render, dispatched right away
+        return float("inf")
+    return len(inp["html"]) + RENDER_COST_PER_SECTION * inp["html"].count("<section")
+
+
+class LookaheadBuffer:
+    """Hold up to `size` upcoming inputs and hand out the most expensive one first.
+
+    Longest-processing-time first ordering within the window, so huge pages do not start last and
+    leave one worker running at the end of the run. size 1 ==> input order.
+    An input passed over by `2 * size` later arrivals is handed out next, so cheap inputs are not starved
+    and results waiting for it in `ReorderBuffer` stay bounded.
+    """
+
+    def __init__(self, inputs, size=1):
+        self.inputs = iter(inputs)
+        self.size = max(size, 1)
+        self.heap = []  # (-cost, arrival order, inp)
+        self.waiting = {}  # arrival order -> inp, of inputs not handed out yet
+        self.num_arrived = 0
+        self.oldest = 0
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def peek(self):
+        while len(self.waiting) < self.size:
+            inp = next(self.inputs, None)
+            if inp is None:
+                break
+            cost = estimate_render_cost(inp) if self.size > 1 else 0
+            heapq.heappush(self.heap, (-cost, self.num_arrived, inp))
+            self.waiting[self.num_arrived] = inp
+            self.num_arrived += 1
+        if len(self.waiting) == 0:
+            return None
+
+        while self.oldest not in self.waiting:
+            self.oldest += 1
+        if self.num_arrived - self.oldest > 2 * self.size:
+            return self.waiting[self.oldest]
+        while self.heap[0][1] not in self.waiting:  # handed out as the oldest one
+            heapq.heappop(self.heap)
+        return self.heap[0][2]
+
+    def pop(self):
+        inp = self.peek()
+        if self.waiting.get(self.oldest) is inp:
+            del self.waiting[self.oldest]
+        else:
+            del self.waiting[heapq.heappop(self.heap)[1]]
+        return inp
+
+
+class ReorderBuffer:
+    """Yield results in the order of their `seq`, so that splits do not depend on completion order.
+
+    Results without `seq` are passed through.
+    """
+
+    def __init__(self):
+        self.buffer = {}
+        self.next_seq = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __call__(self, results):
+        for result in results:
+            if result.get("seq") is None:
+                yield result
+                continue
+            self.buffer[result["seq"]] = result
+            while self.next_seq in self.buffer:
+                yield self.buffer.pop(self.next_seq)
+                self.next_seq += 1
+
+        for seq in sorted(self.buffer):
+            yield self.buffer.pop(seq)
+
+
+def run_tracked(func, arg, job_id, track_dir, memory_watermark=None, memory_cost=0):
+    """Pool job wrapper. Records the job this worker runs and its start time (`track_dir/<pid>`), so that the
+    parent can fail it if the worker dies, or once it ran past its deadline.
+
+    With `memory_watermark`, the job starts only when `memory_cost` bytes are available above the watermark, or
+    when no other job of the pool is running. Jobs admitted by the parent may wait in the pool queue, memory is
+    checked again here when they are about to start.
+    """
+    track_path = os.path.join(track_dir, str(os.getpid()))
+    write_track_file(track_path, str(job_id))  # waiting, still failed by the parent if the worker dies
+    try:
+        if memory_watermark is not None:
+            wait_for_memory(track_dir, memory_watermark + memory_cost)
+        write_track_file(track_path, f"{job_id} {time.time()}")
+        return func(arg)
+    finally:
+        with contextlib.suppress(OSError):  # ThreadPool workers share one pid
+            os.remove(track_path)
+
+
+def wait_for_memory(track_dir, required, poll_interval=0.5):
+    pid = os.getpid()
+    while psutil.virtual_memory().available < required:
+        running = read_track_files(track_dir)
+        if not any(start_time is not None for other, (_, start_time) in running.items() if other != pid):
+            return  # one job always runs
+        time.sleep(poll_interval)
+
+
+def read_track_files(track_dir):
+    """pid -> (job id, start time) of the job of each worker. start time is None while the job waits for memory."""
+    jobs = {}
+    for name in os.listdir(track_dir):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(track_dir, name)) as f:
+                fields = f.read().split()
+            jobs[int(name)] = (int(fields[0]), float(fields[1]) if len(fields) > 1 else None)
+        except (OSError, ValueError, IndexError):
+            continue
+    return jobs
+
+
+def write_track_file(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)  # the parent never reads a partial file
+
+
+def get_failed_result(job):
+    return {"key": job["key"], "seq": job["seq"], "status": "failed"}
+
+
+class JobTracker:
+    """Outstanding jobs of a pool.
+
+    multiprocessing.Pool never calls back a job whose worker died hard (OOM kill, segfault), so the job would be
+    outstanding forever. Such jobs, and jobs running past `deadline` seconds since they started in a worker (their
+    worker is killed), are returned as failed. Jobs still queued in the pool never expire. Late results of expired
+    jobs are dropped.
+    """
+
+    def __init__(self, pool, deadline=None, name="job", memory_watermark=None):
+        self.pool = pool
+        self.deadline = deadline
+        self.memory_watermark = memory_watermark
+        self.name = name
+        self.jobs = {}  # job id -> {"key", "seq"}
+        self.workers = {}  # pid -> process, of pool workers seen so far
+        self.track_dir = tempfile.mkdtemp(prefix="webvicob_jobs_")
+        util.Finalize(self, shutil.rmtree, args=(self.track_dir, True))
+
+        self._results = queue.Queue()  # (job id, result)
+        self._expired = set()
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def _add(self, arg):
+        job_id = self._next_id
+        self._next_id += 1
+        self.jobs[job_id] = {"key": arg.get("key"), "seq": arg.get("seq")}
+        return job_id
+
+    def submit(self, func, arg, memory_cost=0):
+        job_id = self._add(arg)
+        self.pool.apply_async(
+            run_tracked,
+            (func, arg, job_id, self.track_dir, self.memory_watermark, memory_cost),
+            callback=partial(self._put, job_id),
+            error_callback=partial(self._on_error, job_id),
+        )
+
+    def pass_through(self, result):
+        """Count `result` as a job, without running it."""
+        self._put(self._add(result), result)
+
+    def _put(self, job_id, result):
+        self._results.put((job_id, result))
+
+    def _on_error(self, job_id, e):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            print(f"{job['key']} failed in {self.name}: {e!r}", flush=True)
+            self._put(job_id, get_failed_result(job))
+
+    def get(self, timeout):
+        """Next result, None if there is none within `timeout` seconds."""
+        end = time.monotonic() + timeout
+        while True:
+            self.expire()
+            try:
+                job_id, result = self._results.get(timeout=max(min(end - time.monotonic(), 1.0), 0))
+            except queue.Empty:
+                if time.monotonic() >= end:
+                    return None
+                continue
+            if self.jobs.pop(job_id, None) is None:
+                continue  # late result of an expired job
+            self._expired.discard(job_id)
+            return result
+
+    def expire(self):
+        running = self.get_running_jobs()
+        for process in getattr(self.pool, "_pool", []):  # ThreadPool workers have no pid
+            if getattr(process, "pid", None) is not None:
+                self.workers.setdefault(process.pid, process)
+        for pid, process in list(self.workers.items()):
+            if process.exitcode is None:
+                continue
+            del self.workers[pid]
+            job_id, _ = running.pop(pid, (None, None))
+            if process.exitcode != 0 and job_id is not None:
+                self._fail(job_id, f"worker {pid} died with exit code {process.exitcode}")
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(self.track_dir, str(pid)))
+
+        if self.deadline is None:
+            return
+        now = time.time()
+        for pid, (job_id, start_time) in running.items():
+            if start_time is None or job_id not in self.jobs or job_id in self._expired:
+                continue
+            if now - start_time > self.deadline:
+                kill_process_tree(pid)
+                self._fail(job_id, f"deadline of {self.deadline}s exceeded")
+
+    def _fail(self, job_id, reason):
+        job = self.jobs.get(job_id)
+        if job is None or job_id in self._expired:
+            return
+        print(f"{job['key']} failed in {self.name}: {reason}", flush=True)
+        self._expired.add(job_id)
+        self._put(job_id, get_failed_result(job))
+
+    def get_running_jobs(self):
+        """pid -> (job id, start time) of the job of each worker. (`read_track_files`)"""
+        return read_track_files(self.track_dir)
+
+
+def kill_process_tree(pid):
+    try:
+        process = psutil.Process(pid)
+        for child in process.children(recursive=True):
+            child.kill()
+        process.kill()
+    except psutil.Error:
+        pass
+
+
+class RenderScheduler:
+    """Admit render jobs to the pool based on available system memory.
+
+    A job is dispatched only when less than `max_concurrency * in_flight_per_worker` jobs are outstanding
+    (queued in the pool or running) and the available memory minus the predicted cost of the job (and of
+    recently admitted jobs) stays above `memory_watermark`. Jobs queued in the pool (in_flight_per_worker > 1)
+    check the watermark again when a worker picks them up (`run_tracked`). One job is always allowed to run, so a
+    huge page can not block the run forever. With `lookahead` > 1, the most expensive of the next `lookahead` inputs is
+    dispatched first.
+
+    Inputs are pulled from the generator only when a job is admitted, so the parent holds at most
+    `lookahead` + the in-flight window inputs whatever the size of the dump.
+    """
+
+    def __init__(
+        self,
+        pool,
+        func,
+        max_concurrency,
+        memory_watermark_mb=2048,
+        report_interval=60,
+        poll_interval=1.0,
+        lookahead=1,
+        in_flight_per_worker=1,
+        job_deadline=None,
+    ):
+        self.pool = pool
+        self.func = func
+        self.max_concurrency = max_concurrency
+        self.lookahead = lookahead
+        self.window = max_concurrency * max(in_flight_per_worker, 1)
+        self.memory_watermark = memory_watermark_mb * MiB
+        self.report_interval = report_interval
+        self.poll_interval = poll_interval
+
+        self.max_in_flight = 0
+        self.paused = False
+        self.paused_seconds = 0.0
+        self.available = psutil.virtual_memory().available
+        # time-weighted running jobs over the whole run and over the current report period, as
+        # [running job seconds, seconds], sampled every `poll_interval`.
+        self.busy_total = [0.0, 0.0]
+        self.busy_period = [0.0, 0.0]
+
+        self.pending = None
+        self.reorder = None  # ReorderBuffer downstream of the scheduler, reported in `status()`
+
+        self.jobs = JobTracker(pool, job_deadline, name="render", memory_watermark=self.memory_watermark)
+        self._admissions = deque()  # (admitted time, predicted cost)
+        self._last_record = None
+        self._last_report = None
+
+    @property
+    def num_in_flight(self):
+        return len(self.jobs)
+
+    def imap_unordered(self, inputs):
+        self._last_record = self._last_report = time.monotonic()
+        self.pending = pending = LookaheadBuffer(inputs, self.lookahead)
+        while pending.peek() is not None or self.num_in_flight > 0:
+            while pending.peek() is not None and self._admit(pending.peek()):
+                pending.pop()
+
+            self._record()
+            result = self.jobs.get(timeout=self.poll_interval)
+            if result is not None:
+                yield result
+
+    def _admit(self, inp):
+        if self.num_in_flight >= self.window:
+            self.paused = False
+            return False
+        if is_copied(inp):
+            self.jobs.pass_through(inp)
+            return True
+
+        now = time.monotonic()
+        while len(self._admissions) > 0 and now - self._admissions[0][0] > ADMISSION_RAMP_SECONDS:
+            self._admissions.popleft()
+        reserved = sum(cost for _, cost in self._admissions)
+
+        cost = estimate_render_memory(inp)
+        available = psutil.virtual_memory().available - reserved
+        self.paused = self.num_in_flight > 0 and available - cost < self.memory_watermark
+        if self.paused:
+            return False
+
+        self.jobs.submit(self.func, inp, memory_cost=cost)
+        self._admissions.append((now, cost))
+        self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+        return True
+
+    def _record(self):
+        now = time.monotonic()
+        elapsed = now - self._last_record
+        if elapsed < self.poll_interval:
+            return
+        if self.paused:
+            self.paused_seconds += elapsed
+        self._last_record = now
+        num_running = min(self.num_in_flight, self.max_concurrency)
+        for busy in (self.busy_total, self.busy_period):
+            busy[0] += num_running * elapsed
+            busy[1] += elapsed
+        self.available = psutil.virtual_memory().available
+
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            print(f"[scheduler] {self.report(period=True)}", flush=True)
+            self.busy_period = [0.0, 0.0]
+
+    def report(self, period=False):
+        """Effective concurrency (time-weighted mean of running jobs) of the whole run, or of the report period."""
+        busy_seconds, seconds = self.busy_period if period else self.busy_total
+        concurrency = busy_seconds / max(seconds, 1e-6)
+        return (
+            f"concurrency {concurrency:.1f} / {self.max_concurrency} (max {self.max_in_flight}), "
+            f"available memory {self.available / GiB:.1f} GiB, paused {self.paused_seconds:.0f}s, {self.status()}"
+        )
+
+    def status(self):
+        """Parent process memory and the depth of every queue between the input generator and the writer."""
+        rss = psutil.Process(os.getpid()).memory_info().rss
+        return (
+            f"parent rss {rss / MiB:.0f} MiB, in flight {self.num_in_flight} / {self.window}, "
+            f"lookahead {len(self.pending or ())}, reorder {len(self.reorder or ())}"
+        )
+
+
+class PipelineStage:
+    """Run `func` on the results of a previous stage in a separate pool. (e.g. annotation after rendering)
+
+    At most `window` jobs are outstanding in the pool. The previous stage is advanced only when there is room,
+    so its results wait in its own bounded window and its admission stops (backpressure).
+    Results not accepted by `accept` (failed, timed out, copied, ...) are passed through.
+    Jobs of dead workers or past `job_deadline` are returned as failed. (JobTracker)
+    """
+
+    def __init__(self, pool, func, window, accept, name="stage", job_deadline=None, poll_interval=1.0):
+        self.pool = pool
+        self.func = func
+        self.window = window
+        self.accept = accept
+        self.name = name
+        self.poll_interval = poll_interval
+        self.jobs = JobTracker(pool, job_deadline, name=name)
+
+    @property
+    def num_in_flight(self):
+        return len(self.jobs)
+
+    def imap_unordered(self, results):
+        results = iter(results)
+        exhausted = False
+        while not exhausted or self.num_in_flight > 0:
+            if self.num_in_flight >= self.window or (exhausted and self.num_in_flight > 0):
+                result = self.jobs.get(timeout=self.poll_interval)
+                if result is not None:
+                    yield result
+                continue
+
+            result = self.jobs.get(timeout=0)
+            if result is not None:
+                yield result
+                continue
+
+            result = next(results, None)
+            if result is None:
+                exhausted = True
+            elif not self.accept(result):
+                yield result
+            else:
+                self.jobs.submit(self.func, result)
+
+    def status(self):
+        return f"{self.name} in flight {self.num_in_flight} / {self.window}"
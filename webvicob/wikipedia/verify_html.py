@@ -0,0 +1,45 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import random
+from pathlib import Path
+
+import fire
+
+from webvicob.lmdb_maker import WebvicobLMDB, encode
+
+
+def verify_derived_html(lmdb_path, num_samples=100, seed=0):
+    """Check that htmls regenerated from raw html are byte-identical to the stored modified htmls.
+
+    Run it on a split built with html_storage="full" before switching a pipeline to html_storage="derived".
+    Samples without stored html (derived) are regenerated twice to check that the transform is deterministic.
+    """
+    webvicob_lmdb = WebvicobLMDB(Path(lmdb_path), readonly=True, verbose=False, html_cache_size=0)
+    num_data = webvicob_lmdb.get_num_data()
+    indices = random.Random(seed).sample(range(num_data), min(num_samples, num_data))
+
+    counter = {"identical": 0, "mismatch": 0, "no transform": 0}
+    for idx in indices:
+        if webvicob_lmdb.get_html_transform(idx) is None:
+            counter["no transform"] += 1
+            continue
+
+        html_idx = webvicob_lmdb.get_html_idx(idx)
+        stored = webvicob_lmdb.html_compressor.get("html", encode(f"{html_idx}_html"))
+        expected = webvicob_lmdb.derive_html(idx) if stored is None else stored.decode("utf-8")
+        if webvicob_lmdb.derive_html(idx) == expected:
+            counter["identical"] += 1
+        else:
+            counter["mismatch"] += 1
+            print(f"{idx}: regenerated html differs from the stored html.", flush=True)
+    webvicob_lmdb.env.close()
+
+    print(f"{lmdb_path}: {counter} ({len(indices)} / {num_data} samples checked)")
+    return counter["mismatch"] == 0
+
+
+if __name__ == "__main__":
+    fire.Fire(verify_derived_html)
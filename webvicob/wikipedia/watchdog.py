@@ -0,0 +1,123 @@
+"""
+WEBVICOB
+Copyright 2022-present NAVER Corp.
+Apache-2.0
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import psutil
+
+DEFAULT_STAGE_DEADLINES = {
+    "driver": 60,  # chromedriver + chrome startup
+    "load": 120,  # driver.get and first layout
+    "js": 180,  # execute_js
+    "boxes": 120,  # get_boxes
+    "capture": 120,  # Page.captureScreenshot
+}
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage):
+        super().__init__(f"stage '{stage}' exceeded its deadline.")
+        self.stage = stage
+
+
+class StageWatchdog:
+    """Enforce per-stage deadlines of a render.
+
+    A daemon thread checks the running stage, and kills the chrome process tree of this worker when the
+    deadline passes. The blocked selenium call then fails and `stage()` raises StageTimeout.
+    """
+
+    def __init__(self, deadlines=None, poll_interval=0.5):
+        self.deadlines = get_stage_deadlines(deadlines)
+        self.poll_interval = poll_interval
+        self.timed_out_stage = None
+
+        self._stage = None
+        self._deadline = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            self._stage = name
+            self._deadline = time.monotonic() + self.deadlines[name]
+        try:
+            yield
+        except BaseException as e:
+            if self.timed_out_stage == name:
+                raise StageTimeout(name) from e
+            raise
+        finally:
+            with self._lock:
+                self._stage = None
+                self._deadline = None
+
+        if self.timed_out_stage == name:
+            raise StageTimeout(name)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            with self._lock:
+                if self._deadline is None or time.monotonic() < self._deadline:
+                    continue
+                self.timed_out_stage = self._stage
+                self._deadline = None
+            kill_chrome_processes()
+
+
+def get_stage_deadlines(deadlines=None):
+    stage_deadlines = dict(DEFAULT_STAGE_DEADLINES)
+    if deadlines is not None:
+        unknown = set(deadlines) - set(stage_deadlines)
+        assert len(unknown) == 0, f"unknown stages {unknown}. available stages: {list(stage_deadlines)}"
+        stage_deadlines.update(deadlines)
+    return stage_deadlines
+
+
+def kill_chrome_processes():
+    """Kill chromedriver and chrome processes spawned by this process."""
+    procs = []
+    for child in psutil.Process().children(recursive=True):
+        try:
+            if "chrome" in child.name().lower():
+                procs.append(child)
+        except psutil.NoSuchProcess:
+            continue
+
+    for proc in procs:
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            continue
+    psutil.wait_procs(procs, timeout=5)
+
+
+class Quarantine:
+    """Timeout strikes per input key. Inputs with `max_strikes` strikes are skipped in later runs."""
+
+    def __init__(self, path: Path, max_strikes=2):
+        self.path = Path(path)
+        self.max_strikes = max_strikes
+        self.strikes = {}
+        if self.path.exists():
+            self.strikes = json.loads(self.path.read_text())
+
+    def __contains__(self, key):
+        return self.max_strikes is not None and self.strikes.get(key, 0) >= self.max_strikes
+
+    def strike(self, key):
+        self.strikes[key] = self.strikes.get(key, 0) + 1
+        self.path.write_text(json.dumps(self.strikes, indent=1))
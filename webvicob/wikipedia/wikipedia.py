@@ -13,37 +13,85 @@ import random
 import re
 import time
 import traceback
-import unicodedata
 from base64 import b64decode
 from collections import defaultdict
 from copy import deepcopy
+from functools import lru_cache
 from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 from pprint import pprint
-from tempfile import mkdtemp
 from typing import List, Optional
 from uuid import uuid4
 
 import cv2
-import fire
 import numpy as np
-from bs4 import BeautifulSoup, element
-from matplotlib import cm
+from bs4 import BeautifulSoup
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from shapely.geometry import MultiPolygon, Polygon
-from shapely.ops import unary_union
 
+from webvicob.font_catalog import LANG_SCRIPTS, load_font_paths
+from webvicob.html_transform import (
+    INVISIBLE_INLINE_STYLES,
+    REMOVE_SELECTORS,
+    get_html_transform,
+    get_page_styles,
+    modify_html,
+)
+from webvicob.image_codec import (
+    WEBP_MAX_SIZE,
+    encode_img,
+    get_image_codec,
+    is_native_capture,
+)
 from webvicob.lmdb_maker import WebvicobLMDB
+from webvicob.metadata import SampleMetadataWriter, make_sample_meta
 from webvicob.shrinkbox import shrinkbox
 from webvicob.wikipedia.chunker import WikiHtmlChunker
+from webvicob.wikipedia.incremental import (
+    FingerprintIndex,
+    IncrementalBuild,
+    get_build_options,
+)
+from webvicob.wikipedia.profiles import (
+    DISK_CACHE_SIZE,
+    cleanup_orphan_profiles,
+    get_browser_profile,
+)
+from webvicob.wikipedia.quality import check_quality, get_quality_gates
+from webvicob.wikipedia.scheduler import (
+    PipelineStage,
+    RenderScheduler,
+    ReorderBuffer,
+    is_copied,
+)
+from webvicob.wikipedia.watchdog import (
+    Quarantine,
+    StageTimeout,
+    StageWatchdog,
+    get_stage_deadlines,
+    kill_chrome_processes,
+)
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
 
-from pygame import freetype
+# matplotlib (debug visualization), shapely (paragraph polygons) and pygame (glyph metrics) are imported where
+# they are used, so that render workers which never annotate do not pay for them at startup.
 
 base_font_path = Path("font/google/ofl/notosans/NotoSans-Regular.ttf").resolve()
 
+PARA_POLY_ENGINES = ("shapely", "raster", "parity")
+# span: every character is wrapped with an ocr-char span, range: boxes of characters of intact text nodes.
+CHAR_BOX_MODES = ("span", "range")
+PARA_RASTER_SCALE = 0.5
+PARA_PARITY_IOU = 0.9
+
+# Imported once by the forkserver. Workers are forked from it, so recycled workers start with these loaded.
+FORKSERVER_PRELOAD = ["webvicob.wikipedia.wikipedia", "shapely.geometry", "shapely.ops", "pygame.freetype"]
+
+# Last resort deadline of the annotation of one capture. Pool jobs running past their deadline are failed and their
+# worker is killed, e.g. a worker stuck outside of the stages watched by StageWatchdog.
+ANNOTATE_JOB_DEADLINE = 600
+
 
 def main(
     workspace="./",
@@ -66,17 +114,46 @@ def main(
     chrome_path="resources/chromedriver",
     html_section_chunker=True,
     font_dir_path="font/google",
+    para_poly_engine="shapely",
+    stage_deadlines=None,
+    quarantine_strikes=2,
+    memory_watermark_mb=2048,
+    max_chunk_height=None,
+    html_compression=None,
+    bake_styles=False,
+    previous_build=None,
+    html_storage="full",
+    save_box_records=False,
+    task_order="fifo",
+    lpt_lookahead=256,
+    profile_root=None,
+    spatial_index=False,
+    image_codec="jpeg",
+    image_quality=95,
+    jpeg_subsampling=None,
+    in_flight_per_worker=2,
+    quality_gates=None,
+    num_annotate_process=0,
+    start_method="forkserver",
+    multi_width_capture=False,
+    char_boxes="span",
 ):
-    mp.set_start_method("spawn")
+    if start_method not in mp.get_all_start_methods():
+        start_method = "spawn"
+    mp.set_start_method(start_method, force=True)
+    if start_method == "forkserver":
+        mp.set_forkserver_preload(FORKSERVER_PRELOAD)
 
     assert capture_height_limit < 32760  # opencv limit
+    if image_codec == "webp":
+        assert capture_height_limit <= WEBP_MAX_SIZE + 1, f"webp images should be at most {WEBP_MAX_SIZE} px"
     if num_process == -1:
         num_process = os.cpu_count()
     if debug:
         num_process = 1
 
     workspace = Path(workspace)
-    font_paths = get_font_paths(font_dir_path, debug)
+    get_font_paths(font_dir_path, debug, target_lang=target_lang)  # builds the font catalog if needed.
 
     opt = {
         "debug": debug,
@@ -84,24 +161,29 @@ def main(
         "remove_background": remove_background,
         "unroll_contents": unroll_contents,
         "change_para_font": change_para_font,
-        "js_font_paths": ["file:///" + path for path in font_paths],
+        "font_dir_path": str(Path(font_dir_path).resolve()),
         "sleep_time": sleep_time,
         "capture_widths": capture_widths,
         "capture_height_limit": capture_height_limit,
         "target_lang": target_lang,
         "final_width": final_width,
         "chrome_path": chrome_path,
+        "para_poly_engine": para_poly_engine,
+        "stage_deadlines": get_stage_deadlines(stage_deadlines),
+        "bake_styles": bake_styles,
+        "save_box_records": save_box_records,
+        "profile_root": profile_root,
+        "image_codec": get_image_codec(image_codec, image_quality, jpeg_subsampling),
+        "quality_gates": get_quality_gates(quality_gates),
+        "multi_width_capture": multi_width_capture,
+        "char_boxes": char_boxes,
     }
     for k, v in opt.items():
         if k.endswith("font_paths"):
             continue
         print(f"{k}: {v}")
 
-    pickled_opt = bytearray(pickle.dumps(opt))
-    shm_name = f"webvicob_wikipedia_{uuid4()}"
-    shm = SharedMemory(create=True, size=len(pickled_opt), name=shm_name)
-    shm.buf[:] = pickled_opt
-    shm.close()
+    shm_name = f"webvicob_wikipedia_{uuid4()}"  # opt of the workers, created right before the pools
 
     if num_train == -1:
         num_total_data = num_train = math.inf
@@ -111,73 +193,182 @@ def main(
     ver_str = get_version_str(target_lang, num_train, chunk_idx)
     print(f"VER_STR: {ver_str}", flush=True)
     webvicob_lmdbs = {
-        mode: WebvicobLMDB(workspace / ver_str / mode, verbose=False) for mode in ("train", "val", "test")
+        mode: WebvicobLMDB(
+            workspace / ver_str / mode,
+            verbose=False,
+            html_compression=html_compression,
+            html_storage=html_storage,
+            spatial_index=spatial_index,
+        )
+        for mode in ("train", "val", "test")
     }
-    data_counter = {"total": 0, "train": 0, "val": 0, "test": 0}
+    metadata_writers = {mode: SampleMetadataWriter(workspace / ver_str / mode) for mode in webvicob_lmdbs}
+    data_counter = {"total": 0, "train": 0, "val": 0, "test": 0}  # samples, the next idx of each split
+    page_counter = {"total": 0, "train": 0, "val": 0, "test": 0}  # num_train/num_val/num_test count pages
+    max_profile_bytes = 0
+    timeout_counter = defaultdict(int)
+    rejection_counter = defaultdict(int)
+    quarantine = Quarantine(workspace / "quarantine.json", quarantine_strikes)
+
+    chunker = WikiHtmlChunker(max_render_height=max_chunk_height, capture_width=min(capture_widths))
+    fingerprints = FingerprintIndex(get_build_options(opt))
+    incremental = None
+    if previous_build is not None:
+        incremental = IncrementalBuild(previous_build, fingerprints.options)
+    inputs = html_generator(
+        workspace,
+        target_lang,
+        shm_name,
+        chunk_idx,
+        total_chunk,
+        html_section_chunker,
+        chunker,
+        quarantine,
+        is_unchanged=None if incremental is None else incremental.is_unchanged,
+    )
+    if incremental is not None:
+        inputs = incremental.filter(inputs)
 
-    if debug:
-        for inp in html_generator(workspace, target_lang, shm_name, chunk_idx, total_chunk, html_section_chunker):
-            html, modified_html, jpeg, annots = mp_job(inp)
-            if html == "keyboard interrupt":
-                break
-            if html == "None":
-                raise RuntimeError("Failed to capture.")
+    assert task_order in ("fifo", "lpt"), "task_order should be 'fifo' or 'lpt'"
+    if task_order == "lpt":
+        inputs = (dict(inp, seq=seq) for seq, inp in enumerate(inputs))
 
-            if data_counter["total"] < num_val:
+    pool = annotate_pool = scheduler = annotate_stage = None
+    pickled_opt = bytearray(pickle.dumps(opt))
+    shm = SharedMemory(create=True, size=len(pickled_opt), name=shm_name)
+    shm.buf[:] = pickled_opt
+    shm.close()
+    try:
+        if debug:
+            results = (inp if is_copied(inp) else mp_job(inp) for inp in inputs)
+        else:
+            # num_annotate_process > 0 ==> render workers only render, annotations are made in a second pool.
+            jobs = get_worker_module()
+            pool = mp.Pool(num_process, initializer=jobs.load_opt, initargs=(shm_name,), maxtasksperchild=100)
+            scheduler = RenderScheduler(
+                pool,
+                jobs.render_job if num_annotate_process > 0 else jobs.mp_job,
+                num_process,
+                memory_watermark_mb=memory_watermark_mb,
+                lookahead=lpt_lookahead if task_order == "lpt" else 1,
+                in_flight_per_worker=in_flight_per_worker,
+                job_deadline=get_job_deadline(opt, render=True, annotate=num_annotate_process == 0),
+            )
+            results = scheduler.imap_unordered(inputs)
+            if num_annotate_process > 0:
+                annotate_pool = mp.Pool(num_annotate_process, initializer=jobs.load_opt, initargs=(shm_name,))
+                annotate_stage = PipelineStage(
+                    annotate_pool,
+                    jobs.annotate_job,
+                    num_annotate_process * in_flight_per_worker,
+                    accept=lambda result: result["status"] == "rendered",
+                    name="annotate",
+                    job_deadline=get_job_deadline(opt, render=False),
+                )
+                results = annotate_stage.imap_unordered(results)
+        if task_order == "lpt":
+            # dispatch order is by cost, but splits are assigned in input order.
+            reorder = ReorderBuffer()
+            results = reorder(results)
+            if scheduler is not None:
+                scheduler.reorder = reorder
+
+        report_orphan_profiles(profile_root)
+        for result in results:
+            max_profile_bytes = max(max_profile_bytes, result.get("profile_bytes", 0))
+            if result["status"] == "keyboard interrupt":
+                break
+            if result["status"] == "timeout":
+                print(f"{result['key']} timed out at stage '{result['stage']}'.", flush=True)
+                timeout_counter[result["stage"]] += 1
+                quarantine.strike(result["key"])
+            for reason in result.get("rejections", []):
+                rejection_counter[reason] += 1
+            if result["status"] == "rejected":
+                continue
+            if result["status"] not in ("done", "copied"):
+                if debug:
+                    raise RuntimeError("Failed to capture.")
+                print("Failed to capture.")
+                continue
+
+            # every sample of one page (capture widths) goes to one split, so no page is in train and val/test at once.
+            if result["status"] == "copied":  # copied samples keep the split of the previous build
+                mode = result["mode"]
+            elif page_counter["val"] < num_val:
                 mode = "val"
-            elif num_val <= data_counter["total"] < num_test + num_val:
+            elif page_counter["test"] < num_test:
                 mode = "test"
             else:
                 mode = "train"
-            webvicob_lmdb = webvicob_lmdbs[mode]
-
-            webvicob_lmdb.put_raw_html(html, data_counter[mode])
-            webvicob_lmdb.put_html(modified_html, data_counter[mode])
-            webvicob_lmdb.put_img(jpeg, data_counter[mode])
-            webvicob_lmdb.put_annots(annots, data_counter[mode])
-
-            data_counter[mode] += 1
-            data_counter["total"] += 1
-            print(f"[{data_counter['total']} / {num_total_data}] processed.")
+            page_counter[mode] += 1
+            page_counter["total"] += 1
 
-            if data_counter["total"] == num_total_data:
-                break
-    else:
-        with mp.Pool(num_process, maxtasksperchild=100) as pool:
-            for html, modified_html, jpeg, annots in pool.imap_unordered(
-                mp_job,
-                html_generator(workspace, target_lang, shm_name, chunk_idx, total_chunk, html_section_chunker),
-            ):
-                if html == "keyboard interrupt":
-                    break
-                if html == "None":
-                    print("Failed to capture.")
-                    continue
-
-                if data_counter["total"] < num_val:
-                    mode = "val"
-                elif num_val <= data_counter["total"] < num_test + num_val:
-                    mode = "test"
+            webvicob_lmdb = webvicob_lmdbs[mode]
+            html_idx = None  # the samples of a page share the html, stored once
+            samples = [result] if result["status"] == "copied" else result["samples"]
+            for sample in samples:
+                idx = data_counter[mode]
+                if result["status"] == "copied":
+                    incremental.copy_sample(result, webvicob_lmdb, idx)
+                    meta = incremental.get_sample_meta(result, webvicob_lmdb, idx, target_lang)
                 else:
-                    mode = "train"
-                webvicob_lmdb = webvicob_lmdbs[mode]
-
-                webvicob_lmdb.put_raw_html(html, data_counter[mode])
-                webvicob_lmdb.put_html(modified_html, data_counter[mode])
-                webvicob_lmdb.put_img(jpeg, data_counter[mode])
-                webvicob_lmdb.put_annots(annots, data_counter[mode])
+                    if html_idx is not None:
+                        webvicob_lmdb.put_html_ref(html_idx, idx)
+                    else:
+                        webvicob_lmdb.put_raw_html(result["html"], idx)
+                        webvicob_lmdb.put_html(result["modified_html"], idx, get_html_transform(opt))
+                        html_idx = idx
+                    webvicob_lmdb.put_img(sample["jpeg"], idx)
+                    webvicob_lmdb.put_annots(sample["annots"], idx)
+                    for width, jpeg, annots in sample["variants"]:
+                        webvicob_lmdb.put_img(jpeg, idx, width)
+                        webvicob_lmdb.put_annots(annots, idx, width)
+                    if "box_record" in sample:
+                        webvicob_lmdb.put_box_record(sample["box_record"], idx, sample["capture"])
+                    meta = sample["meta"]
+                fingerprints.add(result, mode, idx)
+                metadata_writers[mode].append(idx, meta)
 
                 data_counter[mode] += 1
                 data_counter["total"] += 1
 
-                if data_counter["total"] % 1000 == 0:
-                    print(f"[{ver_str}] [{data_counter['total']} / {num_total_data}] processed.")
-
-                if data_counter["total"] == num_total_data:
-                    break
+                if debug or data_counter["total"] % 1000 == 0:
+                    print(
+                        f"[{ver_str}] [{page_counter['total']} / {num_total_data}] pages processed "
+                        f"({data_counter['total']} samples). "
+                        f"(browser profile: max {max_profile_bytes / 1024**2:.1f} MiB per worker"
+                        + "".join(f", {stage.status()}" for stage in (scheduler, annotate_stage) if stage is not None)
+                        + ")"
+                    )
+
+            # rejected captures of other widths ==> the chunk is incomplete, rendered again by incremental builds.
+            if len(result.get("rejections", [])) == 0:
+                fingerprints.done(result)
+            if page_counter["total"] == num_total_data:
+                break
+    finally:
+        # also on errors and KeyboardInterrupt, so no worker or shared memory segment outlives main().
+        for p in (pool, annotate_pool):
+            if p is not None:
+                p.terminate()
+        shm.unlink()
+
+    if scheduler is not None:
+        print(f"[scheduler] {scheduler.report()}")
+    report_orphan_profiles(profile_root)  # of workers killed by terminate() or crashed
+    if len(timeout_counter) > 0:
+        print(f"timed out pages per stage: {dict(timeout_counter)}")
+    if len(rejection_counter) > 0:
+        print(f"rejected pages per quality gate: {dict(rejection_counter)}")
 
     for mode, webvicob_lmdb in webvicob_lmdbs.items():
         webvicob_lmdb.put_num_data(data_counter[mode])
+        metadata_writers[mode].save()
+    fingerprints.save(workspace / ver_str)
+    if incremental is not None:
+        incremental.save_changelog(workspace / ver_str)
+        incremental.close()
 
     if debug:
         for mode, webvicob_lmdb in webvicob_lmdbs.items():
@@ -187,26 +378,73 @@ def main(
                 annots = webvicob_lmdb.get_annots(i)
                 visualize(img, annots, save=True, idx=i, max_hw=1600)
 
-    shm.unlink()
     for mode, webvicob_lmdb in webvicob_lmdbs.items():
         webvicob_lmdb.wrap_up()
+        if html_compression is not None:
+            print(f"[{mode}] {webvicob_lmdb.html_compressor.report()}")
 
 
-def get_font_paths(font_dir_path, debug):
-    font_paths = []
-    for p in Path(font_dir_path).glob("**/*.ttf"):
-        font_path = str(p.resolve())
-        font_paths.append(font_path)
-
-    print(f"total detected fonts: {len(font_paths)}")
+def get_font_paths(font_dir_path, debug, verbose=True, target_lang=None):
+    """Valid fonts supporting the scripts of `target_lang` (LANG_SCRIPTS), every valid font if none does."""
+    scripts = LANG_SCRIPTS.get(target_lang)
+    font_paths = load_font_paths(font_dir_path, scripts=scripts)
+    if scripts is not None and len(font_paths) == 0:
+        print(f"no font supports {scripts} of {target_lang}, every valid font is used.")
+        font_paths = load_font_paths(font_dir_path)
+    if verbose:
+        print(f"total valid fonts: {len(font_paths)} (scripts: {scripts})")
 
     if debug:
-        print("Debug mode only use first 10 fonts for low memory usage.")
+        if verbose:
+            print("Debug mode only use first 10 fonts for low memory usage.")
         font_paths = font_paths[:10]
 
     return font_paths
 
 
+worker_opt = {}
+
+
+def get_job_deadline(opt, render=True, annotate=True):
+    """Upper bound of the seconds of one pool job, every stage of every capture width running to its deadline."""
+    num_widths = len(opt["capture_widths"]) if opt["multi_width_capture"] else 1
+    deadline = 0
+    if render:
+        deadline += sum(opt["stage_deadlines"].values()) * num_widths
+    if annotate:
+        deadline += ANNOTATE_JOB_DEADLINE * num_widths
+    return deadline
+
+
+def get_worker_module():
+    """This module under its import name.
+
+    Jobs of a `python webvicob/wikipedia/wikipedia.py` run are pickled as `__main__.*`, which forkserver workers
+    can not resolve. Their module is imported (and preloaded) as webvicob.wikipedia.wikipedia.
+    """
+    import webvicob.wikipedia.wikipedia as worker_module
+
+    return worker_module
+
+
+def load_opt(shm_name):
+    """opt of the run, unpickled once per worker process. The font catalog is loaded here too."""
+    if shm_name not in worker_opt:
+        shm = SharedMemory(name=shm_name)
+        opt = pickle.loads(bytes(shm.buf[:]))
+        shm.close()
+        font_paths = get_font_paths(opt["font_dir_path"], opt["debug"], verbose=False, target_lang=opt["target_lang"])
+        opt["js_font_paths"] = ["file:///" + path for path in font_paths]
+        worker_opt[shm_name] = opt
+    return worker_opt[shm_name]
+
+
+def report_orphan_profiles(profile_root):
+    num_removed, num_bytes = cleanup_orphan_profiles(profile_root)
+    if num_removed > 0:
+        print(f"removed {num_removed} orphan browser profiles ({num_bytes / 1024**2:.1f} MiB)")
+
+
 def get_total_size(workspace, target_lang, chunk_idx, total_chunk):
     original_data_path = workspace / "raw"
     jsonl_paths = get_jsonl_paths(original_data_path, target_lang)
@@ -221,23 +459,59 @@ def get_total_size(workspace, target_lang, chunk_idx, total_chunk):
     return total_size
 
 
-def html_generator(workspace, target_lang, shm_name, chunk_idx, total_chunk, html_section_chunker):
+def html_generator(
+    workspace,
+    target_lang,
+    shm_name,
+    chunk_idx,
+    total_chunk,
+    html_section_chunker,
+    chunker=None,
+    quarantine=(),
+    is_unchanged=None,
+):
+    """Html chunks of every article. `is_unchanged(article_id, revision)`: articles kept from a previous build are
+    yielded as one {"status": "unchanged"} input, without parsing their html (`IncrementalBuild`)."""
     original_data_path = workspace / "raw"
     jsonl_paths = get_jsonl_paths(original_data_path, target_lang)
     if chunk_idx is not None and total_chunk is not None:
         jsonl_paths = np.array_split(jsonl_paths, total_chunk)[chunk_idx]
 
-    chunker = WikiHtmlChunker()
+    if chunker is None:
+        chunker = WikiHtmlChunker()
     for jsonl_path in jsonl_paths:
         reader = JsonlReader(jsonl_path)
         for i in range(reader.jsonl_size):
-            html = reader.read_jsonl(i)["article_body"]["html"]
-            html = replace_html(html, target_lang)
-            if html_section_chunker:
-                for html_chunk in chunker(html=html):
-                    yield {"html": html_chunk, "shm_name": shm_name}
-            else:
-                yield {"html": html, "shm_name": shm_name}
+            json_data = reader.read_jsonl(i)
+            article_id, revision = json_data["identifier"], get_revision(json_data)
+            if is_unchanged is not None and is_unchanged(article_id, revision):
+                yield {
+                    "status": "unchanged",
+                    "key": f"{article_id}_unchanged",
+                    "article_id": article_id,
+                    "revision": revision,
+                }
+                continue
+            html = replace_html(json_data["article_body"]["html"], target_lang)
+            html_chunks = chunker(html=html) if html_section_chunker else [html]
+            # quarantined chunks are skipped, `num_chunks` counts the submitted ones so the article can be complete.
+            chunk_nos = [no for no in range(len(html_chunks)) if f"{article_id}_{no}" not in quarantine]
+            for chunk_no in chunk_nos:
+                yield {
+                    "html": html_chunks[chunk_no],
+                    "shm_name": shm_name,
+                    "key": f"{article_id}_{chunk_no}",
+                    "article_id": article_id,
+                    "revision": revision,
+                    "chunk_no": chunk_no,
+                    "num_chunks": len(chunk_nos),
+                }
+
+
+def get_revision(json_data):
+    if "version" in json_data:
+        return json_data["version"]["identifier"]
+    return json_data.get("date_modified")
 
 
 def replace_html(html, target_lang):
@@ -297,7 +571,7 @@ class JsonlReader:
         return json_data
 
 
-def get_driver(chrome_path, headless=True, capture_width=1600):
+def get_driver(chrome_path, headless=True, capture_width=1600, script_timeout=180, profile=None):
     """
     Get google chrome driver.
 
@@ -307,10 +581,13 @@ def get_driver(chrome_path, headless=True, capture_width=1600):
     """
     os.environ["WDM_LOG"] = "0"
     service = Service(chrome_path)
+    if profile is None:
+        profile = get_browser_profile()
+    profile.prepare()
 
     options = webdriver.ChromeOptions()
     options.add_argument("--disable-application-cache")
-    options.add_argument("--disk-cache-size=21474836480")  # 20GB
+    options.add_argument(f"--disk-cache-size={DISK_CACHE_SIZE}")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-dev-tools")
     options.add_argument("--disable-setuid-sandbox")
@@ -321,9 +598,9 @@ def get_driver(chrome_path, headless=True, capture_width=1600):
     options.add_argument(f"--window-size={capture_width},100")
     options.add_argument("--hide-scrollbars")
     options.add_argument("--no-zygote")
-    options.add_argument(f"--user-data-dir={mkdtemp()}")
-    options.add_argument(f"--data-path={mkdtemp()}")
-    options.add_argument(f"--disk-cache-dir={mkdtemp()}")
+    options.add_argument(f"--user-data-dir={profile.user_data_dir}")
+    options.add_argument(f"--data-path={profile.data_path}")
+    options.add_argument(f"--disk-cache-dir={profile.disk_cache_dir}")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
     options.add_experimental_option("prefs", {"profile.default_content_settings.popups": 0})
@@ -333,124 +610,316 @@ def get_driver(chrome_path, headless=True, capture_width=1600):
         options.add_argument("--remote-debugging-port=9222")
 
     driver = webdriver.Chrome(service=service, options=options)
-    driver.timeouts._script = 180
+    driver.timeouts._script = script_timeout
     driver.implicitly_wait(60)
     return driver
 
 
 def mp_job(inp):
+    """Render and annotate a page in one worker."""
+    result = render_job(inp)
+    if result["status"] == "rendered":
+        result = annotate_job(result)
+    return result
+
+
+def render_job(inp):
+    """Browser stage: load the page and capture (jpeg, boxes) of each capture width. Annotated by `annotate_job`.
+
+    One random capture width per page, or every width with `multi_width_capture` (widest first).
+    """
+    result = {
+        "key": inp["key"],
+        "seq": inp.get("seq"),
+        "article_id": inp["article_id"],
+        "revision": inp["revision"],
+        "chunk_no": inp["chunk_no"],
+        "num_chunks": inp["num_chunks"],
+        "shm_name": inp["shm_name"],
+        "status": "failed",
+    }
+    driver = None
+    watchdog = None
+    profile = None
     try:
-        shm = SharedMemory(name=inp["shm_name"])
-        opt = pickle.loads(bytes(shm.buf[:]))
-        capture_width = random.choice(opt["capture_widths"])
+        opt = load_opt(inp["shm_name"])
+        if opt["multi_width_capture"]:
+            capture_widths = sorted(opt["capture_widths"], reverse=True)
+        else:
+            capture_widths = [random.choice(opt["capture_widths"])]
+        watchdog = StageWatchdog(opt["stage_deadlines"])
+        profile = get_browser_profile(opt["profile_root"])
 
-        driver = None
-        try:
-            driver = get_driver(
+        with watchdog.stage("driver"):
+            driver = get_driver_with_retry(
                 chrome_path=opt["chrome_path"],
-                headless=True,
-                capture_width=capture_width,
+                capture_width=capture_widths[0],
+                script_timeout=opt["stage_deadlines"]["js"],
+                watchdog=watchdog,
+                profile=profile,
             )
-        except BaseException as e:
-            time.sleep(10)
-
         if driver is None:
-            return "None", "None", "None", "None"
+            return result
 
-        modified_html = modify_html(inp["html"])
-        load_html(driver, modified_html, f"tmp_{uuid4()}.html")
+        modified_html = modify_html(
+            inp["html"],
+            opt["bake_styles"],
+            opt["remove_background"],
+            opt["unroll_contents"],
+            opt["char_boxes"] == "span",
+        )
+        with watchdog.stage("load"):
+            load_html(driver, modified_html, profile.path / f"tmp_{uuid4()}.html")
 
-        # For faster decision. This also prevents OOM error.
-        # Should be called once more in `capture()` since the page height will be
-        # changed after execute js scripts.
-        page_rect = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+            # For faster decision. This also prevents OOM error.
+            # Should be called once more in `capture()` since the page height will be
+            # changed after execute js scripts.
+            page_rect = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
         capture_height = page_rect["cssContentSize"]["height"] + 50
         if capture_height >= opt["capture_height_limit"]:
-            driver.quit()
             print(f"image height {capture_height} is too big to capture.", flush=True)
-            return "None", "None", "None", "None"
-
-        font2path = execute_js(
-            driver,
-            opt["remove_background"],
-            opt["unroll_contents"],
-            opt["change_para_font"],
-            opt["js_font_paths"],
-        )
+            return result
+
+        with watchdog.stage("js"):
+            font2path, js_timing = execute_js(
+                driver,
+                opt["remove_background"],
+                opt["unroll_contents"],
+                opt["change_para_font"],
+                opt["js_font_paths"],
+                opt["bake_styles"],
+            )
+        if opt["debug"]:
+            print(f"execute_js timing (ms): {js_timing}", flush=True)
         time.sleep(opt["sleep_time"])
-        boxes = get_boxes(driver)
-        jpeg = capture(driver, capture_width, opt["capture_height_limit"])
+
+        captures, rejections = [], []
+        for capture_width in capture_widths:
+            if capture_width != capture_widths[0]:
+                with watchdog.stage("load"):
+                    set_viewport_width(driver, capture_width)
+            with watchdog.stage("boxes"):
+                boxes = get_boxes(driver, opt["char_boxes"])
+                capture_size = (capture_width, get_capture_height(driver))
+            reason = check_quality(boxes, opt["quality_gates"], *capture_size)
+            if reason is not None:
+                rejections.append(reason)
+                continue
+            with watchdog.stage("capture"):
+                jpeg = capture(driver, capture_width, opt["capture_height_limit"], opt["image_codec"])
+            if jpeg is not None:
+                captures.append({"capture_width": capture_width, "jpeg": jpeg, "boxes": boxes})
         driver.quit()
-        if jpeg is None:
-            return "None", "None", "None", "None"
-        annots = create_annotation(jpeg, boxes, font2path, opt["shrink_heuristic"], opt["target_lang"])
-        annots["capture_width"] = capture_width
+        driver = None
+        result["rejections"] = rejections
+        if len(captures) == 0:
+            if len(rejections) > 0:
+                result["status"] = "rejected"
+            return result
+    except KeyboardInterrupt:
+        print("Keyboard interrupted. Shutting down ...")
+        result["status"] = "keyboard interrupt"
+        return result
+
+    except StageTimeout as e:
+        result["status"] = "timeout"
+        result["stage"] = e.stage
+        return result
+
+    except:
+        print(traceback.format_exc(), flush=True)
+        return result
+
+    finally:
+        if watchdog is not None:
+            watchdog.close()
+        if driver is not None:
+            quit_driver(driver)
+        if profile is not None:
+            result["profile_bytes"] = profile.disk_usage()
+
+    result.update(
+        status="rendered",
+        html=inp["html"],
+        modified_html=modified_html,
+        captures=captures,
+        font2path=font2path,
+    )
+    return result
 
-        if opt["final_width"] is not None:
-            jpeg, annots = resize_to_final_width(jpeg, annots, opt["final_width"], capture_width)
+
+def annotate_job(result):
+    """CPU stage: annotations, resized variants and metadata of every capture of a rendered page."""
+    try:
+        opt = load_opt(result["shm_name"])
+        font2path = result.pop("font2path")
+        samples = []
+        for capture in result.pop("captures"):
+            jpeg, boxes, capture_width = capture["jpeg"], capture["boxes"], capture["capture_width"]
+            sample = {}
+            if opt["save_box_records"]:
+                # before create_annotation, which modifies the boxes in place.
+                sample["box_record"] = get_box_record(boxes, font2path, capture_width, opt["target_lang"])
+                sample["capture"] = jpeg if opt["final_width"] is not None else None
+            variants = annotate(jpeg, boxes, font2path, capture_width, opt["target_lang"], opt)
+            _, jpeg, annots = variants[0]
+            meta = make_sample_meta(annots, jpeg, opt["target_lang"], font2path, result["article_id"])
+            sample.update(jpeg=jpeg, annots=annots, variants=variants[1:], meta=meta)
+            samples.append(sample)
     except KeyboardInterrupt:
         print("Keyboard interrupted. Shutting down ...")
-        return "keyboard interrupt", "None", "None", "None"
+        result["status"] = "keyboard interrupt"
+        return result
 
     except:
         print(traceback.format_exc(), flush=True)
-        return "None", "None", "None", "None"
+        result["status"] = "failed"
+        return result
+
+    result.update(status="done", samples=samples)
+    return result
+
+
+def get_box_record(boxes, font2path, capture_width, lang):
+    """Everything `annotate` needs besides the captured jpeg. Replayed by `reannotate` without a browser."""
+    return {"boxes": deepcopy(boxes), "font2path": font2path, "capture_width": capture_width, "lang": lang}
 
-    return inp["html"], modified_html, jpeg, annots
+
+def annotate(jpeg, boxes, font2path, capture_width, lang, opt):
+    """[(final width, jpeg, annots)] of every final width. The first one is the main sample (width None if not resized)."""
+    annots = create_annotation(jpeg, boxes, font2path, opt["shrink_heuristic"], lang, opt["para_poly_engine"])
+    annots["capture_width"] = capture_width
+
+    final_widths = get_final_widths(opt["final_width"])
+    if len(final_widths) == 0:
+        return [(None, jpeg, annots)]
+    return resize_to_final_widths(jpeg, annots, final_widths, capture_width, opt.get("image_codec"))
+
+
+def get_final_widths(final_width):
+    if final_width is None:
+        return []
+    if isinstance(final_width, int):
+        return [final_width]
+    return list(final_width)
+
+
+def get_driver_with_retry(chrome_path, capture_width, script_timeout, watchdog, profile=None, num_retry=2):
+    for retry in range(num_retry + 1):
+        try:
+            return get_driver(
+                chrome_path=chrome_path,
+                headless=True,
+                capture_width=capture_width,
+                script_timeout=script_timeout,
+                profile=profile,
+            )
+        except Exception as e:
+            print(f"Failed to get driver ({retry + 1} / {num_retry + 1}): {e}", flush=True)
+            kill_chrome_processes()
+            if watchdog.timed_out_stage is not None:
+                break
+            time.sleep(retry + 1)
+    return None
+
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        kill_chrome_processes()
 
 
 def resize_to_final_width(jpeg, annots, final_width, capture_width):
+    _, jpeg, annots = resize_to_final_widths(jpeg, annots, [final_width], capture_width)[0]
+    return jpeg, annots
+
+
+def resize_to_final_widths(jpeg, annots, final_widths, capture_width, image_codec=None):
+    """[(final width, jpeg, annots)] of every final width, from one decode and one walk over the annots."""
     buffer = np.frombuffer(jpeg, dtype=np.uint8)
     img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
 
-    ratio = final_width / capture_width
-    img = cv2.resize(img, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_CUBIC)
-    for line in annots["lines"]:
-        line["bbox"] = [val * ratio for val in line["bbox"]]
-        for word in line["words"]:
-            word["bbox"] = [val * ratio for val in word["bbox"]]
-            if word["chars"] is not None:
-                for char in word["chars"]:
-                    char["bbox"] = [val * ratio for val in char["bbox"]]
+    coords = [box[key] for box, key in get_annot_boxes(annots)]
+    flat_coords = np.fromiter((val for coord in coords for val in coord), dtype=np.float64)
+    offsets = np.cumsum([0] + [len(coord) for coord in coords]).tolist()
 
-    for image_annot in annots["images"]:
-        image_annot["bbox"] = [val * ratio for val in image_annot["bbox"]]
+    variants = []
+    for final_width in final_widths:
+        ratio = final_width / capture_width
+        resized = cv2.resize(img, None, fx=ratio, fy=ratio, interpolation=cv2.INTER_CUBIC)
+        resized_jpeg = encode_img(resized, image_codec)
 
-    for para in annots["paragraphs"]:
-        para["poly"] = [val * ratio for val in para["poly"]]
+        scaled = (flat_coords * ratio).tolist()
+        resized_annots = copy_annots(annots)
+        for i, (box, key) in enumerate(get_annot_boxes(resized_annots)):
+            box[key] = scaled[offsets[i] : offsets[i + 1]]
+        variants.append((final_width, resized_jpeg, resized_annots))
+    return variants
 
-    for table in annots["tables"]:
-        table["bbox"] = [val * ratio for val in table["bbox"]]
 
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 95]
-    _, jpeg = cv2.imencode(".jpg", img, encode_param)
+def get_annot_boxes(annots):
+    """(dict, key) of every bbox / poly of annots, in a fixed order."""
+    boxes = []
+    for line in annots["lines"]:
+        boxes.append((line, "bbox"))
+        for word in line["words"]:
+            boxes.append((word, "bbox"))
+            if word["chars"] is not None:
+                boxes += [(char, "bbox") for char in word["chars"]]
+    boxes += [(image_annot, "bbox") for image_annot in annots["images"]]
+    boxes += [(para, "poly") for para in annots["paragraphs"]]
+    boxes += [(table, "bbox") for table in annots["tables"]]
+    return boxes
+
 
-    return jpeg, annots
+def copy_annots(annots):
+    """Copy of the dict/list structure of annots. (much faster than deepcopy, values are replaced anyway)"""
+    copied = dict(annots)
+    copied["lines"] = [
+        {
+            **line,
+            "words": [
+                {**word, "chars": None if word["chars"] is None else [dict(char) for char in word["chars"]]}
+                for word in line["words"]
+            ],
+        }
+        for line in annots["lines"]
+    ]
+    for key in ("images", "paragraphs", "tables"):
+        copied[key] = [dict(annot) for annot in annots[key]]
+    return copied
 
 
-def modify_html(html):
-    html = add_boxes(html)
-    return html
+def execute_js(driver, remove_background, unroll_contents, change_para_font, js_font_paths, baked_styles=False):
+    """Prepare the loaded page in a single `execute_script` round trip.
 
+    Static style rewrites are skipped if they are already baked into the html by `modify_html`.
+    Returns font2path and timing (ms) of each preparation step.
+    """
+    if baked_styles and not change_para_font:
+        return {}, {}
 
-def execute_js(driver, remove_background, unroll_contents, change_para_font, js_font_paths):
-    update_invisible_element_priority(driver)
-    remove_element(driver, "label")
-    remove_pseudo_element(driver)
-    remove_border_bottom(driver)
-    if change_para_font:
-        font2path = change_paragraph_fonts(driver, js_font_paths=js_font_paths)
-    else:
-        font2path = {}
+    opt = {
+        "inlineStyles": [] if baked_styles else INVISIBLE_INLINE_STYLES,
+        "removeSelectors": [] if baked_styles else REMOVE_SELECTORS,
+        "styles": [] if baked_styles else get_page_styles(remove_background, unroll_contents),
+        "changeParaFont": change_para_font,
+        "baseFontPath": "file:///" + str(base_font_path),
+        "fontPaths": js_font_paths if change_para_font else [],
+    }
+    start = time.perf_counter()
+    output = driver.execute_script(PREPARE_PAGE_SCRIPT, opt)
+    output["timing"]["round_trip"] = (time.perf_counter() - start) * 1000
+    return output["font2path"], output["timing"]
 
-    if remove_background:
-        remove_background_image(driver)
-    if unroll_contents:
-        remove_position(driver)
-        remove_float(driver)
-        remove_flexbox(driver)
 
-    return font2path
+def set_viewport_width(driver, capture_width):
+    """Resize the viewport of the loaded page, and wait until it is laid out and painted again."""
+    driver.set_window_size(capture_width, 100)
+    driver.execute_async_script(
+        "const done = arguments[arguments.length - 1]; requestAnimationFrame(() => requestAnimationFrame(done));"
+    )
 
 
 def load_html(driver, html, tmp_path, unlink=True):
@@ -461,19 +930,28 @@ def load_html(driver, html, tmp_path, unlink=True):
         tmp_file.unlink()
 
 
-def capture(driver, capture_width, capture_height_limit):
-    driver.execute_cdp_cmd("Runtime.setMaxCallStackSizeToCapture", {"size": 2**31 - 1})
+def get_capture_height(driver):
     page_rect = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
-    capture_h = page_rect["cssContentSize"]["height"] + 50
+    return page_rect["cssContentSize"]["height"] + 50
+
+
+def capture(driver, capture_width, capture_height_limit, image_codec=None):
+    """Encoded screenshot of the page. Chrome encodes plain jpeg, other codecs are encoded from a png capture."""
+    driver.execute_cdp_cmd("Runtime.setMaxCallStackSizeToCapture", {"size": 2**31 - 1})
+    capture_h = get_capture_height(driver)
     if capture_h >= capture_height_limit:
         print(f"image height {capture_h} is too big to capture.", flush=True)
         return None
 
+    native = is_native_capture(image_codec)
+    if native:
+        capture_format = {"format": "jpeg", "quality": 95 if image_codec is None else image_codec["quality"]}
+    else:
+        capture_format = {"format": "png"}
     img_data = driver.execute_cdp_cmd(
         "Page.captureScreenshot",
         {
-            "format": "jpeg",
-            "quality": 95,
+            **capture_format,
             "captureBeyondViewport": True,
             "fromSurface": True,
             "clip": {
@@ -489,6 +967,9 @@ def capture(driver, capture_width, capture_height_limit):
         return None
 
     jpeg = b64decode(img_data["data"].encode("ascii"))
+    if not native:
+        png = np.frombuffer(jpeg, dtype=np.uint8)
+        jpeg = encode_img(cv2.imdecode(png, cv2.IMREAD_COLOR), image_codec)
     return jpeg
 
 
@@ -546,6 +1027,8 @@ def visualize_paras(image, annots, max_hw=None):
     for para in annots["paragraphs"]:
         boxes.append(para)
 
+    from matplotlib import cm
+
     image = np.copy(image)
     cmap = cm.get_cmap("jet")
 
@@ -602,6 +1085,8 @@ def visualize_latex(image, annots, max_hw=None):
 
 
 def draw_rectangle(image, boxes, max_hw=None):
+    from matplotlib import cm
+
     image = np.copy(image)
     cmap = cm.get_cmap("jet")
 
@@ -624,105 +1109,33 @@ def draw_rectangle(image, boxes, max_hw=None):
 
 
 def add_boxes(html):
-    def _add_boxes(soup, elem):
-        if isinstance(elem, element.NavigableString):
-            tags = []
-
-            for char in elem.text:
-                # ignore control character
-                category = unicodedata.category(char)
-                if category.startswith("C"):
-                    continue
-
-                tag = char
-                if char.strip() != "":
-                    tag = soup.new_tag("span", attrs={"class": "ocr-char"})
-                    tag.string = unicodedata.normalize("NFKC", char)
-
-                tags.append(tag)
-
-            elem.replace_with(*tags)
-            return None
-
-        if isinstance(elem, element.Tag) and elem.name == "svg":
-            return None
-
-        children = list(elem.children)
-
-        for child in children:
-            _add_boxes(soup, child)
-
     soup = BeautifulSoup(html, "html.parser")
-    _add_boxes(soup, soup.body)
+    add_boxes_to_soup(soup)
     html = str(soup)
     return html
 
 
-def add_style(driver, style):
-    script = """
-        document.head.insertAdjacentHTML('beforeend', `<style>${arguments[0]}</style>`)
-    """
-    driver.execute_script(script, style)
-
-
-def add_inline_style(driver, selector, key, value, important=False):
-    priority = "important" if important else ""
-    script = """
-        const elems = document.querySelectorAll(arguments[0]);
-        for (const elem of elems)
-            elem.style.setProperty(arguments[1], arguments[2], arguments[3]);
-    """
-    driver.execute_script(script, selector, key, value, priority)
-
-
-def update_invisible_element_priority(driver):
-    add_inline_style(
-        driver,
-        "*[style*='display: none'], *[style*='display:none']",
-        "display",
-        "none",
-        True,
-    )
-    add_inline_style(
-        driver,
-        "*[style*='visibility: hidden'], *[style*='visibility:hidden']",
-        "visibility",
-        "hidden",
-        True,
-    )
-    add_inline_style(
-        driver,
-        "*[style*='visibility: collapse'], *[style*='visibility:collapse']",
-        "visibility",
-        "collapse",
-        True,
-    )
-    add_inline_style(
-        driver,
-        "*[style*='opacity: 0'], *[style*='opacity:0']",
-        "opacity",
-        "0",
-        True,
-    )
+PREPARE_PAGE_SCRIPT = """
+    const opt = arguments[0];
+    const timing = {};
+    let start = performance.now();
 
-
-def remove_element(driver, selector):
-    script = """
-        const elems = document.querySelectorAll(arguments[0]);
-        for (const elem of elems)
+    for (const [selector, key, value] of opt.inlineStyles) {
+        for (const elem of document.querySelectorAll(selector))
+            elem.style.setProperty(key, value, 'important');
+    }
+    for (const selector of opt.removeSelectors) {
+        for (const elem of document.querySelectorAll(selector))
             elem.remove();
-    """
-    driver.execute_script(script, selector)
-
-
-def change_paragraph_fonts(driver, js_font_paths):
-    script = """
-        const baseFontPath = arguments[0];
-        const fontPaths = arguments[1];
+    }
+    timing.elements = performance.now() - start;
 
+    start = performance.now();
+    let css = opt.styles.join('\\n');
+    const font2path = {};  // use in get_bbox()
+    const targetElements = Array();
+    if (opt.changeParaFont) {
         const targetNodeNames = ["SECTION", "TABLE", "P", "TBODY", "H1", "H2", "H3"];
-        const targetElements = Array();
-
         function element_list(el) {
             if (targetNodeNames.includes(el.nodeName) || el.className === "div-col") {
                 targetElements.push(el);
@@ -733,100 +1146,56 @@ def change_paragraph_fonts(driver, js_font_paths):
         }
         element_list(document);
 
-        const newStyle = document.createElement('style');
-        font2path = {};  // use in get_bbox()
         for (let i = 0; i < targetElements.length; i++) {
-            const fontPath = fontPaths[Math.floor(Math.random() * fontPaths.length)];
+            const fontPath = opt.fontPaths[Math.floor(Math.random() * opt.fontPaths.length)];
             font2path[`font_${String(i)}, font_base`] = fontPath;
-            newStyle.appendChild(document.createTextNode(`\
-                @font-face {\
-                    font-family: font_${String(i)};\
-                    src: url('${fontPath}') format('truetype');\
-                }\
-            `));
+            css += `
+                @font-face {
+                    font-family: font_${String(i)};
+                    src: url('${fontPath}') format('truetype');
+                }
+            `;
         }
-        newStyle.appendChild(document.createTextNode(`\
-            @font-face {\
-                font-family: font_base;\
-                src: url('${baseFontPath}') format('truetype');\
-            }\
-        `));
-        document.head.appendChild(newStyle);
+        css += `
+            @font-face {
+                font-family: font_base;
+                src: url('${opt.baseFontPath}') format('truetype');
+            }
+        `;
+    }
 
+    // Every style change is applied in one batch, chrome recalculates styles once.
+    const newStyle = document.createElement('style');
+    newStyle.appendChild(document.createTextNode(css));
+    document.head.appendChild(newStyle);
+    if (opt.changeParaFont) {
         document.body.style.setProperty('font-family', `font_0`, 'important');
         for (let i = 0; i < targetElements.length; i++) {
             targetElements[i].style.setProperty('font-family', `font_${String(i)}, font_base`, 'important');
         }
+    }
+    timing.styles = performance.now() - start;
 
-        return font2path
-    """
-    base_font_js_path = "file:///" + str(base_font_path)
-    font2path = driver.execute_script(script, base_font_js_path, js_font_paths)
-    return font2path
-
-
-def remove_border_bottom(driver):
-    style = """
-        h1, h2, h3 {
-            border-bottom: none !important;
-        }
-    """
-    add_style(driver, style)
-
-
-def remove_pseudo_element(driver):
-    # https://developer.mozilla.org/en-US/docs/Web/CSS/Pseudo-elements
-    style = """
-        *::before, *::after, ol *::marker {
-            content: none !important;
-        }
-        *::placeholder {
-            opacity: 0 !important;
-        }
-    """
-    add_style(driver, style)
-
-
-def remove_background_image(driver):
-    style = """
-        * {
-            background-image: none !important;
-        }
-    """
-    add_style(driver, style)
-
-
-def remove_position(driver):
-    style = """
-        * {
-            position: static !important;
-        }
-    """
-    add_style(driver, style)
+    start = performance.now();
+    document.body.getBoundingClientRect();  // force style recalculation and layout
+    timing.layout = performance.now() - start;
 
+    return {"font2path": font2path, "timing": timing};
+"""
 
-def remove_float(driver):
-    style = """
-        * {
-            float: none !important;
-        }
-    """
-    add_style(driver, style)
 
+def get_boxes(driver, char_boxes="span"):
+    """Boxes of chars, images, latex, tables of the page.
 
-def remove_flexbox(driver):
-    # https://flexboxfroggy.com/
-    style = """
-        * {
-            flex-flow: row wrap !important;
-            order: 0 !important;
-        }
+    char_boxes="range": chars are not wrapped with spans. Boxes of every character of the text nodes are measured
+    with a reused Range, with the same records (rendered text, bbox, font_family, group) as ocr-char spans.
+    Text nodes rendering nothing are skipped with one getClientRects query, a Range has no per-char bulk query.
     """
-    add_style(driver, style)
-
-
-def get_boxes(driver):
     script = """
+        const charRanges = arguments[0];
+        const range = document.createRange();
+        const controlChar = /\\p{C}/u;
+        let previousChar = ' ';  // last char of the text before, for text-transform: capitalize
         let para_counter = 0;
         let table_counter = 0;
         const paraNodeNames = ["TH", "TR", "TD", "SECTION", "P", "H1", "H2", "H3", "DIV", "UL", "OL"];
@@ -854,12 +1223,16 @@ def get_boxes(driver):
                 group = `paragraph_${para_counter}`;
                 para_counter += 1;
             }
+            if (!style.display.startsWith('inline'))
+                previousChar = ' ';
 
             for (const child of children) {
                 if (child instanceof Element) {
                     const child_rect = child.getBoundingClientRect();
                     boxes = boxes.concat(getBoxes(child, group));
                 }
+                else if (charRanges && child.nodeType === Node.TEXT_NODE && !(node instanceof SVGElement))
+                    boxes = boxes.concat(getCharBoxes(child, group, style, ratio));
             }
 
             let box_type = null;
@@ -890,15 +1263,82 @@ def get_boxes(driver):
 
             return boxes;
         }
+
+        // Rendered text of a char, as innerText of its ocr-char span: NFKC normalized (`add_boxes_to_soup`), then
+        // the computed text-transform. capitalize: first char of each whitespace separated word of the block.
+        function renderChar(char, textTransform) {
+            char = char.normalize('NFKC');
+            const wordStart = previousChar.trim() === '';
+            previousChar = char;
+            if (textTransform === 'uppercase' || (textTransform === 'capitalize' && wordStart))
+                return char.toUpperCase();
+            if (textTransform === 'lowercase')
+                return char.toLowerCase();
+            return char;
+        }
+
+        // same chars as `add_boxes_to_soup`: control chars and spaces are skipped.
+        function getCharBoxes(textNode, group, style, ratio) {
+            const boxes = [];
+            const data = textNode.data;
+            if (data.trim() === '') {  // e.g. collapsed whitespace between blocks, no layout query
+                previousChar = ' ';
+                return boxes;
+            }
+
+            // one query per text node: nodes which render nothing (collapsed, clipped away) are skipped.
+            range.selectNodeContents(textNode);
+            if (range.getClientRects().length === 0)
+                return boxes;
+
+            const fontFamily = style.getPropertyValue('font-family');
+            const textTransform = style.getPropertyValue('text-transform');
+            let offset = 0;
+            for (const char of data) {
+                const start = offset;
+                offset += char.length;
+                if (controlChar.test(char))
+                    continue;
+                const text = renderChar(char, textTransform);
+                if (char.trim() === '')
+                    continue;
+
+                range.setStart(textNode, start);
+                range.setEnd(textNode, offset);
+                const rect = range.getBoundingClientRect();
+                const left = rect.left + window.scrollX;
+                const top = rect.top + window.scrollY;
+                const right = rect.right + window.scrollX;
+                const bottom = rect.bottom + window.scrollY;
+                if (left < 0 || top < 0 || right < 0 || bottom < 0 || (rect.width === 0 && rect.height === 0))
+                    continue;
+
+                boxes.push({
+                    "box_type": "char",
+                    "text": text,
+                    "alt": "",
+                    "bbox": [
+                        Math.round(left * ratio),
+                        top * ratio,
+                        Math.round(right * ratio),
+                        bottom * ratio,
+                    ],
+                    "font_family": fontFamily,
+                    "group": group
+                });
+            }
+            return boxes;
+        }
         return getBoxes(document.body, "");
     """
-    boxes = driver.execute_script(script)
+    assert char_boxes in CHAR_BOX_MODES, f"char_boxes should be one of {CHAR_BOX_MODES}"
+    boxes = driver.execute_script(script, char_boxes == "range")
     return boxes
 
 
-def create_annotation(image, boxes, font2path, shrink_heuristic, lang):
+def create_annotation(image, boxes, font2path, shrink_heuristic, lang, para_poly_engine="shapely"):
     shrink_height(image, boxes, font2path, shrink_heuristic)
-    make_para_polys(boxes)
+    make_para_polys(boxes, para_poly_engine)
 
     nested_annots = {
         "paragraphs": [],
@@ -978,11 +1418,7 @@ def get_glyph_ratio(font_path, char):
         return None, None
 
     try:
-        if not freetype.was_init():
-            freetype.init()
-
-        font = freetype.Font(font_path)
-        font.size = 100
+        font = get_freetype_font(font_path)
         font.pad = False
         left, top, width, height = font.get_rect(char)
         font.pad = True
@@ -1000,35 +1436,125 @@ def get_glyph_ratio(font_path, char):
     return top_ratio, bottom_ratio
 
 
-def make_para_polys(boxes):
+@lru_cache(maxsize=256)
+def get_freetype_font(font_path):
+    from pygame import freetype
+
+    if not freetype.was_init():
+        freetype.init()
+
+    font = freetype.Font(font_path)
+    font.size = 100
+    return font
+
+
+def make_para_polys(boxes, engine="shapely"):
+    """Make paragraph polygons by morphological closing of char boxes in each paragraph group.
+
+    engine:
+        shapely: geometric closing with shapely buffers.
+        raster: closing on a downsampled mask with opencv. Much faster on long paragraphs and tables.
+        parity: shapely output is used, raster output is compared with it and low IoU groups are reported.
+    """
+    assert engine in PARA_POLY_ENGINES, f"para_poly_engine should be one of {PARA_POLY_ENGINES}"
+
     group2cboxes = defaultdict(list)
     for box in boxes:
         if box["box_type"] == "char" and box["group"].startswith("paragraph_"):
             group2cboxes[box["group"]].append(box)
 
-    for cboxes in group2cboxes.values():
-        polys = [Polygon(bbox2quad(box["bbox"])) for box in cboxes]
-        buf_size = math.sqrt(sum(poly.area for poly in polys) / len(polys))
-        buf_size = round(buf_size * 1.5, 2)
-        multi_poly = MultiPolygon(polys)
-
-        # morphological closing
-        multi_poly = multi_poly.buffer(buf_size).buffer(-buf_size)
-        union = unary_union(multi_poly)
-
-        if isinstance(union, Polygon):
-            para_box = {"box_type": "paragraph", "poly": []}
-            for x, y in reversed(list(union.exterior.coords)[:-1]):
-                para_box["poly"].append(int(round(x)))
-                para_box["poly"].append(int(round(y)))
-            boxes.append(para_box)
+    for group, cboxes in group2cboxes.items():
+        if engine == "raster":
+            polys = raster_para_polys(cboxes)
         else:
-            for geom in union.geoms:
-                para_box = {"box_type": "paragraph", "poly": []}
-                for x, y in reversed(list(geom.exterior.coords)[:-1]):
-                    para_box["poly"].append(int(round(x)))
-                    para_box["poly"].append(int(round(y)))
-                boxes.append(para_box)
+            polys = shapely_para_polys(cboxes)
+
+        if engine == "parity":
+            iou = para_polys_iou(polys, raster_para_polys(cboxes))
+            if iou < PARA_PARITY_IOU:
+                print(f"{group}: raster paragraph polygon IoU {iou:.3f} with shapely.", flush=True)
+
+        for poly in polys:
+            boxes.append({"box_type": "paragraph", "poly": poly})
+
+
+def shapely_para_polys(cboxes):
+    from shapely.geometry import MultiPolygon, Polygon
+    from shapely.ops import unary_union
+
+    polys = [Polygon(bbox2quad(box["bbox"])) for box in cboxes]
+    buf_size = math.sqrt(sum(poly.area for poly in polys) / len(polys))
+    buf_size = round(buf_size * 1.5, 2)
+    multi_poly = MultiPolygon(polys)
+
+    # morphological closing
+    multi_poly = multi_poly.buffer(buf_size).buffer(-buf_size)
+    union = unary_union(multi_poly)
+
+    geoms = [union] if isinstance(union, Polygon) else union.geoms
+    para_polys = []
+    for geom in geoms:
+        para_poly = []
+        for x, y in reversed(list(geom.exterior.coords)[:-1]):
+            para_poly.append(int(round(x)))
+            para_poly.append(int(round(y)))
+        para_polys.append(para_poly)
+    return para_polys
+
+
+def raster_para_polys(cboxes, scale=PARA_RASTER_SCALE):
+    """Same closing as `shapely_para_polys`, computed on a mask downsampled by `scale`."""
+    bboxes = np.array([box["bbox"] for box in cboxes], dtype=np.float64)
+    areas = np.abs((bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1]))
+    buf_size = round(math.sqrt(areas.mean()) * 1.5, 2)
+
+    # padding keeps dilation inside the mask
+    pad = math.ceil(buf_size) + 2
+    x0 = bboxes[:, [0, 2]].min() - pad
+    y0 = bboxes[:, [1, 3]].min() - pad
+    mask_w = math.ceil((bboxes[:, [0, 2]].max() + pad - x0) * scale) + 1
+    mask_h = math.ceil((bboxes[:, [1, 3]].max() + pad - y0) * scale) + 1
+    mask = np.zeros((mask_h, mask_w), dtype=np.uint8)
+
+    x1 = np.floor((np.minimum(bboxes[:, 0], bboxes[:, 2]) - x0) * scale)
+    y1 = np.floor((np.minimum(bboxes[:, 1], bboxes[:, 3]) - y0) * scale)
+    x2 = np.maximum(np.ceil((np.maximum(bboxes[:, 0], bboxes[:, 2]) - x0) * scale) - 1, x1)
+    y2 = np.maximum(np.ceil((np.maximum(bboxes[:, 1], bboxes[:, 3]) - y0) * scale) - 1, y1)
+    quads = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape((-1, 4, 2)).astype(np.int32)
+    cv2.fillPoly(mask, list(quads), 1)
+
+    # morphological closing
+    radius = int(round(buf_size * scale))
+    if radius > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    para_polys = []
+    for contour in contours:
+        if len(contour) < 3:
+            continue
+        # same vertex order as `shapely_para_polys`
+        points = contour.reshape((-1, 2))[::-1].astype(np.float64)
+        points = (points + 0.5) / scale + np.array([x0, y0])
+        para_polys.append(np.round(points).astype(int).reshape(-1).tolist())
+    return para_polys
+
+
+def para_polys_iou(polys1, polys2):
+    """IoU between the areas covered by two lists of paragraph polygons."""
+    from shapely.geometry import Polygon
+    from shapely.ops import unary_union
+
+    def _union(polys):
+        polys = [Polygon(np.array(poly).reshape((-1, 2))).buffer(0) for poly in polys if len(poly) >= 6]
+        return unary_union(polys)
+
+    union1, union2 = _union(polys1), _union(polys2)
+    union_area = union1.union(union2).area
+    if union_area == 0:
+        return 1.0
+    return union1.intersection(union2).area / union_area
 
 
 def line_grouping(cl_boxes):
@@ -1210,4 +1736,6 @@ def quad2bbox(quad):
 
 
 if __name__ == "__main__":
+    import fire
+
     fire.Fire(main)